@@ -0,0 +1,241 @@
+"""Time and check the detection pipeline on synthetic or recorded frames.
+
+Synthetic frames are built by pasting one template of every group from
+templates/ into noise (or --background) at random, non-overlapping positions,
+so every expected detection is known. Recorded frames are read from a
+directory of PNG screenshots; an optional labels.json in that directory,
+{"frame.png": {"global_chat": [[x, y], ...], ...}}, enables the same checks.
+
+For every frame and group this times match_template_with_confidence,
+non_max_suppression and get_cropped_images, then detect_template end to end
+on a fresh Frame, and checks the detections against the expected positions.
+Results are written as JSON so runs can be compared.
+
+Run from the repository root:
+    python benchmarks/detection.py --synthetic 20
+    python benchmarks/detection.py --frames recordings/session1 --output before.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config  # noqa: E402
+from capture import ReplayCapture  # noqa: E402
+from frame import Frame  # noqa: E402
+from template_matcher import TemplateMatcher  # noqa: E402
+
+POSITION_TOLERANCE = 3
+STAGES = ('match', 'nms', 'crop', 'detect_template')
+
+
+def build_synthetic(directory, count, size, background=None, seed=0):
+    """Write count synthetic frames and their labels.json into directory."""
+    rng = random.Random(seed)
+    noise = np.random.default_rng(seed)
+    height, width = size
+    base = None
+    if background is not None:
+        base = cv2.imread(background, cv2.IMREAD_COLOR)
+        if base is None:
+            raise FileNotFoundError(f"Background could not be read: {background}")
+        base = cv2.resize(base, (width, height), interpolation=cv2.INTER_AREA)
+
+    labels = {}
+    for index in range(count):
+        if base is None:
+            image = noise.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        else:
+            image = base.copy()
+
+        placed, expected = [], {}
+        for group, paths in config.templates.items():
+            template = cv2.imread(rng.choice(paths), cv2.IMREAD_COLOR)
+            h, w = template.shape[:2]
+            for _ in range(100):
+                x, y = rng.randrange(0, width - w), rng.randrange(0, height - h)
+                if not any(x < px + pw and px < x + w and y < py + ph and py < y + h
+                           for px, py, pw, ph in placed):
+                    break
+            else:
+                raise RuntimeError(f"No free spot for {group} on a {width}x{height} frame.")
+            image[y:y + h, x:x + w] = template
+            placed.append((x, y, w, h))
+            expected[group] = [[x, y]]
+
+        name = f"synthetic_{index:04d}.png"
+        cv2.imwrite(os.path.join(directory, name), image)
+        labels[name] = expected
+
+    with open(os.path.join(directory, 'labels.json'), 'w') as f:
+        json.dump(labels, f, indent=2)
+
+
+def load_labels(directory):
+    path = os.path.join(directory, 'labels.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_matcher(capture, args):
+    settings = dict(config.matcher_config)
+    settings.update(
+        capture_backend=capture,
+        tracking=args.tracking,
+        diff_gate=args.diff_gate,
+        match_workers=args.workers,
+    )
+    settings.pop('replay_path')
+    settings.pop('match_processes')
+    return TemplateMatcher(**settings)
+
+
+def timed(timings, stage, group, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(stage, {}).setdefault(group, []).append(time.perf_counter() - start)
+    return result
+
+
+def score(boxes, expected):
+    """Count true positives, false positives and misses of boxes against expected top-left corners."""
+    remaining = [tuple(point) for point in expected]
+    hits = 0
+    for x, y, *_ in boxes:
+        for point in remaining:
+            if abs(x - point[0]) <= POSITION_TOLERANCE and abs(y - point[1]) <= POSITION_TOLERANCE:
+                remaining.remove(point)
+                hits += 1
+                break
+    return hits, len(boxes) - hits, len(remaining)
+
+
+def run(matcher, capture, labels, runs):
+    timings = {}
+    accuracy = {}
+    for run_index in range(runs):
+        for path in capture.paths:
+            image = capture.grab(None)
+            expected = labels.get(os.path.basename(path), {}) if labels is not None else None
+            for group, templates in config.templates.items():
+                pyramid = group in matcher.pyramid_groups
+                boxes = timed(timings, 'match', group,
+                              matcher.match_template_with_confidence, image, templates, None, pyramid)
+                boxes = timed(timings, 'nms', group, matcher.non_max_suppression, boxes)
+                timed(timings, 'crop', group,
+                      matcher.get_cropped_images, image, boxes, config.offsets.get(group, {}))
+
+                frame = Frame(image, {'left': 0, 'top': 0}, {'left': 0, 'top': 0})
+                timed(timings, 'detect_template', group,
+                      matcher.detect_template, group, False, False, frame)
+
+                if run_index == 0:
+                    counts = accuracy.setdefault(group, {'hits': 0, 'false_positives': 0,
+                                                         'misses': 0, 'detections': 0})
+                    counts['detections'] += len(frame.boxes.get(group, []))
+                    if expected is not None:
+                        hits, false_positives, misses = score(
+                            frame.boxes.get(group, []), expected.get(group, []))
+                        counts['hits'] += hits
+                        counts['false_positives'] += false_positives
+                        counts['misses'] += misses
+    return timings, accuracy
+
+
+def summarize(timings):
+    summary = {}
+    for stage, groups in timings.items():
+        for group, values in groups.items():
+            values = np.array(values) * 1000
+            summary.setdefault(stage, {})[group] = {
+                'runs': len(values),
+                'mean_ms': round(float(values.mean()), 3),
+                'p50_ms': round(float(np.percentile(values, 50)), 3),
+                'p95_ms': round(float(np.percentile(values, 95)), 3),
+                'min_ms': round(float(values.min()), 3),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--frames', help="directory of recorded PNG frames (default: synthetic)")
+    parser.add_argument('--synthetic', type=int, default=20, help="number of synthetic frames")
+    parser.add_argument('--size', default='1024x768', help="synthetic frame size, WIDTHxHEIGHT")
+    parser.add_argument('--background', help="image to paste synthetic templates into instead of noise")
+    parser.add_argument('--save-synthetic', help="keep the synthetic frames and labels in this directory")
+    parser.add_argument('--runs', type=int, default=3, help="passes over the frames")
+    parser.add_argument('--workers', type=int, default=config.matcher_config['match_workers'])
+    parser.add_argument('--tracking', action='store_true', help="enable ROI tracking")
+    parser.add_argument('--diff-gate', action='store_true', help="enable the diff gate")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='detection_benchmark.json')
+    args = parser.parse_args()
+
+    temp = None
+    directory = args.frames
+    if directory is None:
+        directory = args.save_synthetic
+        if directory is None:
+            temp = tempfile.TemporaryDirectory()
+            directory = temp.name
+        os.makedirs(directory, exist_ok=True)
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        build_synthetic(directory, args.synthetic, (height, width), args.background, args.seed)
+
+    capture = ReplayCapture(directory, preload=True)
+    labels = load_labels(directory)
+    matcher = build_matcher(capture, args)
+    timings, accuracy = run(matcher, capture, labels, args.runs)
+    if temp is not None:
+        temp.cleanup()
+
+    for counts in accuracy.values():
+        found = counts['hits'] + counts['false_positives']
+        expected = counts['hits'] + counts['misses']
+        counts['precision'] = round(counts['hits'] / found, 4) if found else None
+        counts['recall'] = round(counts['hits'] / expected, 4) if expected else None
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source': args.frames or f"synthetic ({args.synthetic} frames, {args.size}, seed {args.seed})",
+        'frames': len(capture.paths),
+        'runs': args.runs,
+        'labelled': labels is not None,
+        'settings': {
+            'threshold': matcher.threshold,
+            'overlap_threshold': matcher.overlap_threshold,
+            'pyramid_groups': sorted(matcher.pyramid_groups),
+            'workers': args.workers,
+            'tracking': args.tracking,
+            'diff_gate': args.diff_gate,
+        },
+        'stages': summarize(timings),
+        'accuracy': accuracy,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{results['frames']} frames x {args.runs} runs from {results['source']}")
+    for stage in STAGES:
+        for group, stats in results['stages'].get(stage, {}).items():
+            print(f"{stage:16s} {group:22s} {stats['mean_ms']:9.2f} ms mean {stats['p95_ms']:9.2f} ms p95")
+    for group, counts in accuracy.items():
+        if labels is not None:
+            print(f"{group:22s} precision {counts['precision']}  recall {counts['recall']}")
+        else:
+            print(f"{group:22s} {counts['detections']} detections (no labels.json)")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
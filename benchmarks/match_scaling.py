@@ -0,0 +1,127 @@
+"""Measure detection throughput against the number of match worker processes.
+
+Runs detect_many for every template group on each frame, with tracking and
+the diff gate off so every frame is matched in full, first in-process on the
+match_workers thread pool and then through a match_pool.MatchPool of each
+requested size. With --windows N, N matchers share the pool and take turns,
+as the bot does when it drives N game windows. Detections are compared with
+the in-process run, and frames/sec per setting is printed and written as JSON.
+
+Run from the repository root:
+    python benchmarks/match_scaling.py --processes 1,2,4,8
+    python benchmarks/match_scaling.py --frames recordings/session1 --windows 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config  # noqa: E402
+from capture import ReplayCapture  # noqa: E402
+from detection import build_synthetic  # noqa: E402
+from frame import Frame  # noqa: E402
+from match_pool import MatchPool  # noqa: E402
+from template_matcher import TemplateBank, TemplateMatcher  # noqa: E402
+
+
+def build_matchers(count, capture, bank, threads, process_pool=None):
+    settings = dict(config.matcher_config)
+    settings.update(capture_backend=capture, tracking=False, diff_gate=False,
+                    match_workers=threads, bank=bank, process_pool=process_pool)
+    settings.pop('replay_path')
+    settings.pop('match_processes')
+    return [TemplateMatcher(**settings) for _ in range(count)]
+
+
+def run(matchers, images, runs):
+    """Detect every group on every image with each matcher in turn; returns (seconds, detections of the first pass)."""
+    groups = list(config.templates)
+    for matcher in matchers:
+        matcher.warm_up()
+    detections = []
+    start = time.perf_counter()
+    for run_index in range(runs):
+        for image in images:
+            for matcher in matchers:
+                frame = Frame(image, {'left': 0, 'top': 0}, {'left': 0, 'top': 0})
+                matcher.detect_many(frame, groups)
+                if run_index == 0 and matcher is matchers[0]:
+                    detections.append({name: np.asarray(frame.boxes.get(name, ())).tolist() for name in groups})
+    return time.perf_counter() - start, detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--frames', help="directory of recorded PNG frames (default: synthetic)")
+    parser.add_argument('--synthetic', type=int, default=10, help="number of synthetic frames")
+    parser.add_argument('--size', default='1024x768', help="synthetic frame size, WIDTHxHEIGHT")
+    parser.add_argument('--processes', default='1,2,4', help="comma separated worker process counts")
+    parser.add_argument('--threads', type=int, default=config.matcher_config['match_workers'],
+                        help="match_workers for the in-process run")
+    parser.add_argument('--windows', type=int, default=1, help="matchers sharing the pool")
+    parser.add_argument('--runs', type=int, default=3, help="passes over the frames")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='match_scaling.json')
+    args = parser.parse_args()
+
+    temp = None
+    directory = args.frames
+    if directory is None:
+        temp = tempfile.TemporaryDirectory()
+        directory = temp.name
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        build_synthetic(directory, args.synthetic, (height, width), seed=args.seed)
+    capture = ReplayCapture(directory, preload=True)
+    images = capture.images
+    bank = TemplateBank(config.templates)
+    frames = len(images) * args.runs * args.windows
+
+    results = []
+    seconds, baseline = run(build_matchers(args.windows, capture, bank, args.threads), images, args.runs)
+    results.append({'mode': 'threads', 'workers': args.threads, 'seconds': seconds,
+                    'matches_baseline': True})
+    for count in (int(value) for value in args.processes.split(',')):
+        pool = MatchPool(config.templates, count)
+        try:
+            matchers = build_matchers(args.windows, capture, bank, args.threads, pool)
+            seconds, detections = run(matchers, images, args.runs)
+        finally:
+            pool.shutdown()
+        results.append({'mode': 'processes', 'workers': count, 'seconds': seconds,
+                        'matches_baseline': detections == baseline})
+    if temp is not None:
+        temp.cleanup()
+
+    for result in results:
+        result['frames_per_second'] = round(frames / result['seconds'], 2)
+        result['ms_per_frame'] = round(result['seconds'] / frames * 1000, 3)
+        result['speedup'] = round(results[0]['seconds'] / result['seconds'], 2)
+        result['seconds'] = round(result['seconds'], 3)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source': args.frames or f"synthetic ({args.synthetic} frames, {args.size}, seed {args.seed})",
+        'frames': frames,
+        'windows': args.windows,
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{frames} frames ({len(images)} x {args.runs} runs x {args.windows} windows), "
+          f"{os.cpu_count()} CPUs")
+    for result in results:
+        check = "" if result['matches_baseline'] else "  DETECTIONS DIFFER"
+        print(f"{result['mode']:10s} {result['workers']:3d} workers  {result['frames_per_second']:8.2f} "
+              f"frames/s  {result['ms_per_frame']:8.2f} ms/frame  x{result['speedup']:.2f}{check}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
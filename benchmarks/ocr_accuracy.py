@@ -0,0 +1,323 @@
+"""Check the chat OCR (ocr.py) for accuracy and throughput on labelled crops.
+
+By default it runs on benchmarks/ocr_fixtures: labels.json for chat crops
+saved from the game by TemplateMatcher.refresh_and_display (in
+output_images, with its green debug border) and a glyph directory. Labels
+are {"crop.png": {"group": template group, "learn": bool, "lines": [...]}},
+paths relative to labels.json. The group picks the message pane from
+config.ocr["areas"]. The glyphs are learned from the crops marked "learn",
+so lines whose text is in those crops are counted apart from new lines:
+only the new ones say how the OCR does on text it has not seen. --learn
+rebuilds the glyph directory.
+
+--synthetic instead builds a stand-in bitmap font from OpenCV's Hershey
+font, drawn without anti-aliasing (glyphs that come out pixel-identical
+to an earlier one are dropped, e.g. "l" and "I"), and writes crops of 1-6
+lines of chat-like text in a random bright colour on a dark, noisy
+background. That only checks the decoder, not the game's font.
+
+For every crop it reads the lines and compares them with the labels. It
+reports:
+- exact lines and the character error rate, for new and for learned lines
+- how many crops would go out as text at --min-confidence, and how many
+  of those are exactly right
+- crops and lines per second
+- text bytes against the bytes of the encoded image
+
+Run from the repository root:
+    python benchmarks/ocr_accuracy.py
+    python benchmarks/ocr_accuracy.py --learn
+    python benchmarks/ocr_accuracy.py --synthetic --crops 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config  # noqa: E402
+from encoder import CropEncoder  # noqa: E402
+from ocr import ChatOCR, GlyphFont, binarize, find_lines, runs  # noqa: E402
+
+# Template groups the bot sends as text; see encode_crops in knight_chat_bot.py.
+TEXT_GROUPS = ('global_chat', 'private_chat_content')
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr_fixtures')
+FONT_HEIGHT = 16
+BASELINE = 12
+CHARSET = [chr(code) for code in range(33, 127)]
+WORDS = ("selling buying party wts wtb pm me looking for clan join now price pot str dex int "
+         "armor +7 +8 ring earring 50k 1.2m gold exp event tonight at moradon luferson el morad "
+         "karus anyone help quest boss drop rare ok thx lol brb gg").split()
+
+
+def build_font():
+    """A stand-in bitmap font: the Hershey glyphs drawn without anti-aliasing, one blank column after each."""
+    font, seen = GlyphFont(height=FONT_HEIGHT), set()
+    for char in CHARSET:
+        canvas = np.zeros((FONT_HEIGHT, 24), np.uint8)
+        cv2.putText(canvas, char, (1, BASELINE), cv2.FONT_HERSHEY_PLAIN, 1.0, 255, 1, cv2.LINE_4)
+        # putText still blends the edges a little; a bitmap font has none.
+        canvas = np.where(canvas > 127, 255, 0).astype(np.uint8)
+        columns = np.flatnonzero(canvas.any(axis=0))
+        cell = np.zeros((FONT_HEIGHT, columns[-1] - columns[0] + 2), np.uint8)
+        cell[:, :-1] = canvas[:, columns[0]:columns[-1] + 1]
+        key = (cell.shape, cell.tobytes())
+        if key in seen:
+            continue
+        seen.add(key)
+        font.add(char, cell)
+    font.add(' ', np.zeros((FONT_HEIGHT, 5), np.uint8))
+    return font
+
+
+def render_line(font, text):
+    cells = [font.glyphs[char]['cell'] for char in text]
+    return np.concatenate(cells, axis=1) if cells else np.zeros((font.height, 0), np.float32)
+
+
+def random_line(rng, font, width):
+    """Chat-like text that fits in width pixels, using only characters the font has."""
+    name = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+                   for _ in range(rng.randint(4, 10)))
+    words = [name + ':'] + [rng.choice(WORDS) for _ in range(rng.randint(2, 12))]
+    if rng.random() < 0.3:
+        words.append(rng.choice(['!!', '?', '...', '(100)', '[pm]', '5*', '#1', '&', '~']))
+    text = ''
+    for word in words:
+        candidate = f"{text} {word}" if text else word
+        candidate = ''.join(char for char in candidate if char in font.glyphs)
+        if render_line(font, candidate).shape[1] > width:
+            break
+        text = candidate
+    return text
+
+
+def build_fixtures(directory, font, count, width=570, noise=30, seed=0):
+    """Write count chat crops and their labels.json into directory."""
+    rng = random.Random(seed)
+    pixels = np.random.default_rng(seed)
+    line_height = font.height + 2
+    labels = {}
+    for index in range(count):
+        lines = [random_line(rng, font, width - 8) for _ in range(rng.randint(1, 6))]
+        height = line_height * len(lines) + 6
+        image = pixels.integers(10, 10 + noise, (height, width, 3), dtype=np.uint8)
+        for number, text in enumerate(lines):
+            mask = render_line(font, text) > 0
+            color = [rng.randint(60, 255) for _ in range(3)]
+            color[rng.randrange(3)] = rng.randint(200, 255)
+            top, left = 3 + number * line_height, 4
+            area = image[top:top + font.height, left:left + mask.shape[1]]
+            area[mask] = color
+        name = f"chat_{index:04d}.png"
+        cv2.imwrite(os.path.join(directory, name), image)
+        labels[name] = {'group': None, 'learn': False, 'lines': lines}
+    with open(os.path.join(directory, 'labels.json'), 'w') as f:
+        json.dump(labels, f, indent=2)
+
+
+def load_crops(directory):
+    with open(os.path.join(directory, 'labels.json')) as f:
+        labels = json.load(f)
+    crops = []
+    for name in sorted(labels):
+        image = cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(f"Cannot read {name} in {directory}")
+        crops.append((name, image))
+    return labels, crops
+
+
+def learn_font(crops, labels, ink_ratio, ink_threshold=None):
+    """Learn a font from the crops labelled "learn", line by line.
+
+    The font height is the tallest run of ink rows, so some line needs both
+    an ascender and a descender; lines with less ink height are skipped.
+    Glyphs touching an unknown one can only be cut out once the other is
+    known, so the lines are learned again until no glyph is added.
+    """
+    lines = []
+    for name, image in crops:
+        label = labels[name]
+        if not label['learn']:
+            continue
+        area = config.ocr['areas'].get(label['group'])
+        if area is not None:
+            x, y, w, h = area
+            image = image[y:y + h, x:x + w]
+        mask = binarize(image, ink_threshold, ink_ratio)
+        height = max(end - start for start, end in runs(mask.any(axis=1)))
+        for (top, bottom), text in zip(find_lines(mask, height), label['lines']):
+            lines.append((mask[top:bottom], text))
+    font = GlyphFont(height=max(mask.shape[0] for mask, _ in lines))
+    while True:
+        added = []
+        for mask, text in lines:
+            try:
+                added += font.learn(mask, text)
+            except ValueError as e:
+                print(f"Skipped {text!r}: {e}")
+        if not added:
+            return font
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def run(ocr, crops, labels, runs, min_confidence, learned=()):
+    """Accuracy, throughput and sizes over crops; labels[name] has 'group' and 'lines'.
+
+    Lines whose text is in learned are counted apart from new ones.
+    """
+    counts = {'crops': len(crops), 'lines': 0, 'missing_lines': 0, 'text_crops': 0, 'text_crops_exact': 0}
+    line_counts = {kind: {'lines': 0, 'exact_lines': 0, 'characters': 0, 'errors': 0}
+                   for kind in ('new', 'learned')}
+    sizes = {'text': [], 'image': [], 'jpeg': []}
+    read_lines = {}
+    encoder = CropEncoder(workers=1)
+    for name, image in crops:
+        lines = ocr.read(image, config.ocr['areas'].get(labels[name]['group']))
+        expected = labels[name]['lines']
+        read = [line['text'] for line in lines]
+        read_lines[name] = read
+        counts['lines'] += len(expected)
+        counts['missing_lines'] += max(len(expected) - len(read), 0)
+        for index, text in enumerate(expected):
+            got = read[index] if index < len(read) else ''
+            kind = line_counts['learned' if text in learned else 'new']
+            kind['lines'] += 1
+            kind['exact_lines'] += got == text
+            kind['characters'] += len(text)
+            kind['errors'] += edit_distance(got, text)
+        if lines and min(line['confidence'] for line in lines) >= min_confidence:
+            counts['text_crops'] += 1
+            counts['text_crops_exact'] += read == expected
+        sizes['text'].append(len("\n".join(read).encode('utf-8')))
+        sizes['image'].append(len(encoder.encode(image)[1]))
+        sizes['jpeg'].append(len(cv2.imencode('.jpg', image)[1]))
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for name, image in crops:
+            ocr.read(image, config.ocr['areas'].get(labels[name]['group']))
+    seconds = (time.perf_counter() - start) / runs
+
+    return {
+        'lines_by_kind': {kind: {
+            'lines': stats['lines'],
+            'exact_line_rate': round(stats['exact_lines'] / stats['lines'], 4),
+            'character_error_rate': round(stats['errors'] / max(stats['characters'], 1), 4),
+        } for kind, stats in line_counts.items() if stats['lines']},
+        'text_crop_rate': round(counts['text_crops'] / len(crops), 4),
+        'text_crop_precision': round(counts['text_crops_exact'] / counts['text_crops'], 4)
+        if counts['text_crops'] else None,
+        'crops_per_second': round(len(crops) / seconds, 1),
+        'lines_per_second': round(counts['lines'] / seconds, 1),
+        'ms_per_crop': round(seconds / len(crops) * 1000, 3),
+        'mean_bytes': {kind: round(float(np.mean(values)), 1) for kind, values in sizes.items()},
+        'counts': counts,
+        'read': read_lines,
+    }
+
+
+def report(results):
+    counts = results['counts']
+    print(f"{counts['crops']} crops, {counts['lines']} lines")
+    for kind, stats in results['lines_by_kind'].items():
+        print(f"  {kind} lines ({stats['lines']}): exact {stats['exact_line_rate']:.2%}, "
+              f"character error rate {stats['character_error_rate']:.2%}")
+    precision = results['text_crop_precision']
+    print(f"  sent as text: {results['text_crop_rate']:.2%} of crops, "
+          f"{'-' if precision is None else f'{precision:.2%}'} of them exact")
+    print(f"  {results['crops_per_second']} crops/s, {results['lines_per_second']} lines/s, "
+          f"{results['ms_per_crop']} ms/crop")
+    sizes = results['mean_bytes']
+    print(f"  mean bytes per crop: text {sizes['text']}, encoded image {sizes['image']}, default JPEG {sizes['jpeg']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--fixtures', default=FIXTURES, help="directory of labelled crops")
+    parser.add_argument('--glyphs', help="glyph directory (default: glyphs in --fixtures)")
+    parser.add_argument('--learn', action='store_true',
+                        help="learn the glyph directory again from the crops labelled \"learn\" first")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="use generated crops in a stand-in Hershey bitmap font instead")
+    parser.add_argument('--crops', type=int, default=100, help="number of generated crops")
+    parser.add_argument('--noise', type=int, default=30, help="background noise of generated crops, in gray levels")
+    parser.add_argument('--save-fixtures', help="keep the generated crops, labels and glyphs in this directory")
+    parser.add_argument('--min-confidence', type=float, default=config.ocr['min_confidence'])
+    parser.add_argument('--glyph-threshold', type=float, default=config.ocr['glyph_threshold'])
+    parser.add_argument('--ink-ratio', type=float, default=config.ocr['ink_ratio'])
+    parser.add_argument('--runs', type=int, default=3, help="timed passes over the crops")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='ocr_benchmark.json')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        font = build_font()
+        ink_ratio = None
+        temp = None
+        directory = args.save_fixtures
+        if directory is None:
+            temp = tempfile.TemporaryDirectory()
+            directory = temp.name
+        os.makedirs(directory, exist_ok=True)
+        build_fixtures(directory, font, args.crops, noise=args.noise, seed=args.seed)
+        if args.save_fixtures:
+            font.save(os.path.join(directory, 'glyphs'))
+        labels, crops = load_crops(directory)
+        if temp is not None:
+            temp.cleanup()
+        font_name = f"stand-in Hershey bitmap font ({len(font.glyphs) - 1} glyphs)"
+        source = f"generated ({args.crops} crops, noise {args.noise}, seed {args.seed})"
+    else:
+        ink_ratio = args.ink_ratio
+        glyphs = args.glyphs or os.path.join(args.fixtures, 'glyphs')
+        labels, crops = load_crops(args.fixtures)
+        if args.learn:
+            font = learn_font(crops, labels, ink_ratio, config.ocr['ink_threshold'])
+            font.save(glyphs)
+            print(f"Learned {len(font.glyphs)} glyphs into {glyphs}: {''.join(sorted(font.glyphs))!r}")
+        font = GlyphFont.load(glyphs)
+        font_name = glyphs
+        source = args.fixtures
+
+    ocr = ChatOCR(font, glyph_threshold=args.glyph_threshold,
+                  ink_threshold=config.ocr['ink_threshold'], ink_ratio=ink_ratio)
+    learned = {text for label in labels.values() if label['learn'] for text in label['lines']}
+    groups = {label['group'] for label in labels.values()}
+    results = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'font': font_name,
+        'source': source,
+        'min_confidence': args.min_confidence,
+        'glyph_threshold': args.glyph_threshold,
+        'ink_ratio': ink_ratio,
+        'groups_without_fixtures': [] if args.synthetic else sorted(set(TEXT_GROUPS) - groups),
+        **run(ocr, crops, labels, args.runs, args.min_confidence, learned),
+    }
+    print(f"{source}, font: {font_name}, confidence {args.min_confidence}")
+    report(results)
+    if results['groups_without_fixtures']:
+        print(f"No fixtures for: {', '.join(results['groups_without_fixtures'])}")
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
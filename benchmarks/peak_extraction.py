@@ -0,0 +1,91 @@
+"""Compare per-pixel candidate lists with vectorized peak extraction on a dense match result.
+
+Run from the repository root:
+    python benchmarks/peak_extraction.py
+"""
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from template_matcher import extract_peaks  # noqa: E402
+
+THRESHOLD = 0.6
+OVERLAP_THRESHOLD = 0.4
+TEMPLATE_W, TEMPLATE_H = 569, 22
+RUNS = 5
+
+
+def dense_result_map(height=1000, width=1400, seed=0):
+    """Smooth noise centred just under the threshold, so about a third of it is over."""
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((height, width)).astype(np.float32)
+    smooth = cv2.GaussianBlur(noise, (0, 0), 3)
+    smooth = smooth / smooth.std() * 0.2 + 0.5
+    return np.clip(smooth, -1.0, 1.0)
+
+
+def legacy_candidates(result):
+    """The previous path: one Python tuple per pixel over the threshold."""
+    locations = np.where(result >= THRESHOLD)
+    confidences = [result[pt[1], pt[0]] for pt in zip(*locations[::-1])]
+    boxes = [
+        (pt[0], pt[1], TEMPLATE_W, TEMPLATE_H, conf)
+        for pt, conf in zip(zip(*locations[::-1]), confidences)
+    ]
+    boxes = np.array(boxes)
+    indices = cv2.dnn.NMSBoxes(
+        bboxes=[[int(x), int(y), int(w), int(h)] for x, y, w, h in boxes[:, :4]],
+        scores=boxes[:, 4].tolist(),
+        score_threshold=THRESHOLD,
+        nms_threshold=OVERLAP_THRESHOLD,
+    )
+    return len(boxes), len(indices)
+
+
+def vectorized_candidates(result, kernel, max_peaks):
+    """The current path: local maxima as one compact array straight into NMS."""
+    points = extract_peaks(result, THRESHOLD, kernel, max_peaks)
+    boxes = np.empty((len(points), 4), np.int32)
+    boxes[:, :2] = points[:, :2]
+    boxes[:, 2] = TEMPLATE_W
+    boxes[:, 3] = TEMPLATE_H
+    indices = cv2.dnn.NMSBoxes(
+        bboxes=boxes,
+        scores=points[:, 2],
+        score_threshold=THRESHOLD,
+        nms_threshold=OVERLAP_THRESHOLD,
+    )
+    return len(points), len(indices)
+
+
+def best_of(func, *args):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        counts = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), counts
+
+
+def main():
+    result = dense_result_map()
+    over = int((result >= THRESHOLD).sum())
+    print(f"Result map {result.shape[1]}x{result.shape[0]}, {over} pixels over {THRESHOLD}")
+
+    legacy_time, (legacy_candidates_count, legacy_kept) = best_of(legacy_candidates, result)
+    print(f"before: {legacy_time * 1000:8.1f} ms  {legacy_candidates_count:7d} candidates -> {legacy_kept} boxes")
+
+    kernel = np.ones((3, 3), np.uint8)
+    for max_peaks in (64, 100000):
+        fast_time, (fast_candidates_count, fast_kept) = best_of(
+            vectorized_candidates, result, kernel, max_peaks)
+        print(f"after:  {fast_time * 1000:8.1f} ms  {fast_candidates_count:7d} candidates -> {fast_kept} boxes"
+              f"  (max_peaks={max_peaks}, {legacy_time / fast_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Local stand-in for the chat server, for headless end-to-end runs of the bot.
+
+Serves one WebSocket on localhost, waits for the bot to connect, sends a
+script of commands, each with an "id", and records every reply. The bot
+acknowledges each command with that id once it has handled it, so the time
+from send to ack is the end-to-end command latency. When the script is done
+it writes a JSON report with latency percentiles per action and the replies
+received, and exits.
+
+With --launch it also starts the bot in replay mode on the given frames and
+stops it at the end, so one command runs the whole thing, e.g. on CI:
+
+    python benchmarks/replay_server.py --launch recordings/session1 --output replay.json
+
+A script is a JSON list of commands; "delay" (seconds to wait before sending,
+default 0.5) and "repeat" are read by this server and not sent:
+
+    [{"action": "request_chat_data", "repeat": 10},
+     {"action": "send_global_chat", "msg": "hello", "delay": 1}]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import websockets
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+USERNAME = "replay"
+
+DEFAULT_SCRIPT = [
+    {"action": "request_chat_data", "repeat": 10, "delay": 0.2},
+    {"action": "reset_view"},
+    {"action": "send_global_chat", "msg": "replay test"},
+    {"action": "start_private_chat", "coords": {"x": 100, "y": 100, "w": 40, "h": 20}},
+    {"action": "send_private_chat", "msg": "replay private"},
+    {"action": "stop_private_chat"},
+    {"action": "start_auto_chat", "campaign_id": "replay", "messages": ["a", "b"],
+     "interval": 2, "duration": 5},
+    {"action": "auto_chat_status", "delay": 3},
+    {"action": "stop_auto_chat", "campaign_id": "replay"},
+    {"action": "force_resend"},
+    {"action": "request_chat_data", "repeat": 5, "delay": 0.2},
+]
+
+
+def expand(script):
+    commands = []
+    for step in script:
+        step = dict(step)
+        repeat = step.pop("repeat", 1)
+        delay = step.pop("delay", 0.5)
+        step.setdefault("username", USERNAME)
+        commands.extend([(delay, step)] * repeat)
+    return commands
+
+
+def describe(message):
+    """Short record of a reply; images are reduced to their sizes."""
+    if isinstance(message, bytes):
+        return {"type": "binary", "bytes": len(message)}
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return {"type": "invalid", "bytes": len(message)}
+    return {"type": data.get("type"), "bytes": len(message),
+            **{key: data[key] for key in ("id", "action", "campaigns") if key in data}}
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p90_ms": round(float(np.percentile(values, 90)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+class ReplayServer:
+    def __init__(self, commands, ack_timeout):
+        self.commands = commands
+        self.ack_timeout = ack_timeout
+        self.sent = {}
+        self.latencies = {}
+        self.replies = []
+        self.done = asyncio.Event()
+
+    async def handle(self, socket):
+        print("Bot connected.")
+        receiver = asyncio.create_task(self.receive(socket))
+        try:
+            for command_id, (delay, command) in enumerate(self.commands):
+                await asyncio.sleep(delay)
+                self.sent[command_id] = (command["action"], time.perf_counter())
+                await socket.send(json.dumps({**command, "id": command_id}))
+            deadline = time.perf_counter() + self.ack_timeout
+            while self.sent and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            receiver.cancel()
+            self.done.set()
+
+    async def receive(self, socket):
+        async for message in socket:
+            now = time.perf_counter()
+            reply = describe(message)
+            reply["time"] = round(time.time(), 3)
+            self.replies.append(reply)
+            if reply["type"] == "ack" and reply.get("id") in self.sent:
+                action, sent_at = self.sent.pop(reply["id"])
+                self.latencies.setdefault(action, []).append(now - sent_at)
+
+    def report(self):
+        every = [value for values in self.latencies.values() for value in values]
+        counts = {}
+        for reply in self.replies:
+            counts[reply["type"]] = counts.get(reply["type"], 0) + 1
+        return {
+            "commands": len(self.commands),
+            "unacknowledged": sorted(action for action, _ in self.sent.values()),
+            "latency": percentiles(every) if every else None,
+            "latency_by_action": {action: percentiles(values)
+                                  for action, values in sorted(self.latencies.items())},
+            "reply_counts": counts,
+            "replies": self.replies,
+        }
+
+
+async def main(args):
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    server = ReplayServer(expand(script), args.ack_timeout)
+
+    bot = None
+    async with websockets.serve(server.handle, "127.0.0.1", args.port, max_size=None):
+        print(f"Replay server listening on ws://127.0.0.1:{args.port}")
+        if args.launch:
+            bot = subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "knight_chat_bot.py"),
+                 "--replay", os.path.abspath(args.launch),
+                 "--server", f"ws://127.0.0.1:{args.port}"],
+                cwd=ROOT)
+        try:
+            await asyncio.wait_for(server.done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            print(f"Gave up after {args.timeout}s.")
+        finally:
+            if bot is not None:
+                bot.terminate()
+                bot.wait()
+
+    report = server.report()
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if report["latency"]:
+        print("End-to-end latency: " + ", ".join(
+            f"{key} {value}" for key, value in report["latency"].items()))
+    for action, stats in report["latency_by_action"].items():
+        print(f"  {action:20s} n={stats['count']:3d}  p50 {stats['p50_ms']:8.1f} ms"
+              f"  p90 {stats['p90_ms']:8.1f} ms  max {stats['max_ms']:8.1f} ms")
+    print(f"Replies: {report['reply_counts']}")
+    if report["unacknowledged"]:
+        print(f"Not acknowledged: {report['unacknowledged']}")
+    print(f"Report written to {args.output}")
+    return 1 if report["unacknowledged"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="JSON list of commands (default: a built-in tour of the actions)")
+    parser.add_argument("--launch", help="start knight_chat_bot.py in replay mode on these frames")
+    parser.add_argument("--ack-timeout", type=float, default=10,
+                        help="seconds to wait for outstanding acks after the last command")
+    parser.add_argument("--timeout", type=float, default=300, help="give up after this many seconds")
+    parser.add_argument("--output", default="replay_report.json")
+    sys.exit(asyncio.run(main(parser.parse_args())))
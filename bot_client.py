@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import json
+import threading
+import websockets
+from command_queue import CommandExecutor
+from logger import log
+
+# Lower runs first. Stop commands jump ahead of queued work, and the
+# periodic tick yields to every server command.
+COMMAND_PRIORITIES = {
+    'stop_auto_chat': 0,
+    'stop_private_chat': 0,
+    'tick': 9,
+}
+DEFAULT_PRIORITY = 5
+
+# Queued commands that become pointless once the key command arrives.
+COMMAND_CANCELS = {
+    'stop_private_chat': {'start_private_chat', 'send_private_chat'},
+}
+
+# A duplicate of a queued command with the same username is dropped; the
+# queued one captures the screen when it runs, so it answers both. The
+# duplicate is passed to on_coalesced after it, e.g. to acknowledge its id.
+COALESCED_COMMANDS = {'request_chat_data'}
+
+
+class BotClient:
+    """Owns the server connection, the periodic tick and command dispatch on one asyncio event loop.
+
+    Capture, matching and input are blocking, so command handlers and ticks run
+    on a single worker thread behind a priority queue; mouse and keyboard input
+    is global to the desktop and must not interleave. The event loop itself only
+    does network I/O and scheduling, so frames, pings and stop commands are
+    received, and queued ahead of other work, while a command is still running.
+    """
+
+    def __init__(self, url, on_command, on_tick, on_open=None, on_coalesced=None, tick_interval=3,
+                 ping_interval=10, reconnect_delay=3, send_timeout=10, executor=None, lane=None):
+        self.url = url
+        self.on_command = on_command
+        self.on_tick = on_tick
+        self.on_open = on_open
+        self.on_coalesced = on_coalesced
+        self.tick_interval = tick_interval
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.send_timeout = send_timeout
+
+        self.connected = False
+        self.pm_active = False
+        # Application state for this connection, e.g. the game window it drives.
+        self.session = None
+
+        self.loop = None
+        self.loop_thread = None
+        self.socket = None
+        # Clients driving several game windows share one executor, so their
+        # input never interleaves; each uses its own lane in it.
+        self.owns_executor = executor is None
+        self.executor = executor or CommandExecutor()
+        self.lane = lane
+
+    def send(self, data):
+        """Send a text (str) or binary (bytes) frame from a worker thread and wait until it is written."""
+        if threading.get_ident() == self.loop_thread:
+            raise RuntimeError("BotClient.send blocks; call it from the worker thread.")
+        socket = self.socket
+        if socket is None:
+            raise ConnectionError("WebSocket is not connected.")
+        future = asyncio.run_coroutine_threadsafe(socket.send(data), self.loop)
+        future.result(timeout=self.send_timeout)
+
+    def run_blocking(self, func, *args, name=None, coalesce_key=None, on_coalesced=None):
+        """Queue a blocking function on the worker thread and return an awaitable for its result."""
+        name = name or func.__name__
+        future = self.executor.submit(
+            name, func, *args,
+            priority=COMMAND_PRIORITIES.get(name, DEFAULT_PRIORITY),
+            coalesce_key=coalesce_key, lane=self.lane, on_coalesced=on_coalesced)
+        return asyncio.wrap_future(future, loop=self.loop)
+
+    def spawn(self, coroutine):
+        """Schedule a coroutine on the event loop from any thread and return its task."""
+        if threading.get_ident() == self.loop_thread:
+            return self.loop.create_task(coroutine)
+        return asyncio.run_coroutine_threadsafe(
+            self.wrap_task(coroutine), self.loop).result()
+
+    async def wrap_task(self, coroutine):
+        return asyncio.get_running_loop().create_task(coroutine)
+
+    def cancel(self, task):
+        """Cancel a task started with spawn, from any thread."""
+        self.loop.call_soon_threadsafe(task.cancel)
+
+    async def run(self):
+        """Connect, dispatch commands and tick until cancelled, reconnecting whenever the socket drops."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        ticker = asyncio.create_task(self.tick_forever())
+        try:
+            while True:
+                await self.serve_connection()
+                log.warning(f"Reconnecting to {self.url} in {self.reconnect_delay}s...")
+                await asyncio.sleep(self.reconnect_delay)
+        finally:
+            ticker.cancel()
+            if self.owns_executor:
+                self.executor.shutdown()
+
+    async def serve_connection(self):
+        try:
+            log.debug("Attempting to connect to WebSocket...")
+            async with websockets.connect(
+                    self.url, ping_interval=self.ping_interval, max_size=None) as socket:
+                self.socket = socket
+                self.connected = True
+                log.info("WebSocket connection established.")
+                if self.on_open is not None:
+                    self.on_open(self)
+                async for message in socket:
+                    self.dispatch(message)
+                log.warning("WebSocket closed by the server.")
+        except Exception as e:
+            log.error(f"WebSocket error: {e}")
+        finally:
+            self.connected = False
+            self.socket = None
+
+    def dispatch(self, message):
+        """Queue a received message for the command handler without waiting for it."""
+        action, username = None, None
+        try:
+            data = json.loads(message)
+            action, username = data.get("action"), data.get("username")
+        except (ValueError, AttributeError):
+            pass  # the handler reports malformed messages
+
+        cancels = COMMAND_CANCELS.get(action)
+        if cancels:
+            dropped = self.executor.cancel_queued(cancels, self.lane)
+            if dropped:
+                log.warning(f"{action}: dropped {dropped} queued command(s).")
+
+        coalesce_key, on_coalesced = None, None
+        if action in COALESCED_COMMANDS:
+            coalesce_key = username
+            if self.on_coalesced is not None:
+                on_coalesced = functools.partial(self.on_coalesced, self, message)
+        future = self.run_blocking(
+            self.on_command, self, message, name=action or "invalid",
+            coalesce_key=coalesce_key, on_coalesced=on_coalesced)
+        future.add_done_callback(self.report_failure)
+
+    @staticmethod
+    def report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error(f"Error handling command: {future.exception()}")
+
+    async def tick_forever(self):
+        """Run the periodic tick on the worker thread, one at a time, while connected."""
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            if not self.connected:
+                continue
+            try:
+                await self.run_blocking(self.on_tick, self, name='tick')
+            except Exception as e:
+                log.error(f"Error during periodic tick: {e}")
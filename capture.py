@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from logger import log
+
+
+class CaptureBackend:
+    """Grabs a BGR image of a screen area and keeps latency and copy counters."""
+
+    name = "base"
+    # Backends that capture the real screen need the game window's geometry.
+    requires_window = True
+
+    def __init__(self):
+        self.stats = {'captures': 0, 'seconds': 0.0, 'bytes_copied': 0}
+
+    def grab(self, bbox):
+        """Capture bbox (left, top, right, bottom) and return a BGR image, or None."""
+        start = time.perf_counter()
+        image, bytes_copied = self._grab(bbox)
+        self.stats['seconds'] += time.perf_counter() - start
+        self.stats['captures'] += 1
+        self.stats['bytes_copied'] += bytes_copied
+        return image
+
+    def _grab(self, bbox):
+        """Return (image, bytes copied to produce it)."""
+        raise NotImplementedError
+
+    def summary(self):
+        """Average latency and bytes copied per capture."""
+        captures = self.stats['captures']
+        if not captures:
+            return f"{self.name}: no captures"
+        avg_ms = self.stats['seconds'] / captures * 1000
+        avg_mb = self.stats['bytes_copied'] / captures / 1e6
+        return f"{self.name}: {captures} captures, {avg_ms:.1f} ms and {avg_mb:.1f} MB copied per capture"
+
+
+class PILCapture(CaptureBackend):
+    """PIL ImageGrab, then a NumPy copy, then an RGB to BGR conversion: three full-frame copies."""
+
+    name = "pil"
+
+    def __init__(self):
+        super().__init__()
+        from PIL import ImageGrab
+        self.image_grab = ImageGrab
+
+    def _grab(self, bbox):
+        screenshot = self.image_grab.grab(bbox=bbox)
+        image = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+        return image, 3 * image.nbytes
+
+
+class MSSCapture(CaptureBackend):
+    """mss screen grab converted into a small ring of preallocated BGR buffers.
+
+    The BGRA pixels from mss are viewed without copying and converted straight
+    into a reused buffer, so a capture costs the grab plus one conversion. A
+    returned image stays valid until the ring wraps around, i.e. for the next
+    buffers - 1 captures.
+    """
+
+    name = "mss"
+
+    def __init__(self, buffers=3):
+        super().__init__()
+        import mss
+        self.mss = mss
+        self.local = threading.local()
+        self.buffers = [None] * buffers
+        self.next_buffer = 0
+        # Grabs can come from several threads; each takes its own ring slot.
+        self.lock = threading.Lock()
+
+    def _grab(self, bbox):
+        left, top, right, bottom = bbox
+        width, height = right - left, bottom - top
+        if not hasattr(self.local, 'sct'):
+            # mss handles are not shareable between threads.
+            self.local.sct = self.mss.mss()
+        try:
+            shot = self.local.sct.grab(
+                {'left': left, 'top': top, 'width': width, 'height': height})
+        except self.mss.exception.ScreenShotError as e:
+            # Reported like a failed PIL grab, see capture_window_image.
+            raise ValueError(f"mss could not grab the screen: {e}") from e
+        bgra = np.frombuffer(shot.raw, np.uint8).reshape(height, width, 4)
+
+        with self.lock:
+            buffer = self.buffers[self.next_buffer]
+            if buffer is None or buffer.shape[:2] != (height, width):
+                buffer = np.empty((height, width, 3), np.uint8)
+                self.buffers[self.next_buffer] = buffer
+            self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=buffer)
+        return buffer, bgra.nbytes + buffer.nbytes
+
+
+class ReplayCapture(CaptureBackend):
+    """Replays recorded PNG frames from a file or directory, ignoring the requested area.
+
+    Frames are returned in file name order and the sequence loops. With preload
+    set, every frame is decoded once up front and replayed from memory, which is
+    what benchmarks want; note that callers then share the same arrays.
+    """
+
+    name = "replay"
+    requires_window = False
+
+    def __init__(self, path, loop=True, preload=False):
+        super().__init__()
+        if os.path.isdir(path):
+            self.paths = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith('.png'))
+        else:
+            self.paths = [path]
+        if not self.paths:
+            raise FileNotFoundError(f"No PNG frames found in {path}")
+        self.loop = loop
+        self.index = 0
+        self.images = [self.read(p) for p in self.paths] if preload else None
+
+    @staticmethod
+    def read(path):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise FileNotFoundError(f"Replay frame could not be read: {path}")
+        return image
+
+    def _grab(self, bbox):
+        if self.index >= len(self.paths):
+            if not self.loop:
+                return None, 0
+            self.index = 0
+        position = self.index
+        self.index += 1
+        if self.images is not None:
+            return self.images[position], 0
+        image = self.read(self.paths[position])
+        return image, image.nbytes
+
+
+def create_backend(name, replay_path=None):
+    """Build a capture backend by name: 'pil', 'mss' or 'replay'."""
+    if name == "replay":
+        if not replay_path:
+            raise ValueError("The replay capture backend needs a replay_path.")
+        return ReplayCapture(replay_path)
+    if name == "mss":
+        try:
+            return MSSCapture()
+        except ImportError:
+            log.warning("mss is not installed, falling back to the PIL capture backend.")
+    return PILCapture()
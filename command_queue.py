@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from logger import log
+
+
+class CommandExecutor:
+    """Single worker thread running queued commands by priority (lower runs first).
+
+    Commands of equal priority run in submission order, except that commands
+    submitted on different lanes (one per game window) take turns, so a busy
+    window cannot starve the others. A queued command can be cancelled or
+    coalesced with a duplicate, but a command that has started always runs to
+    the end. Queue wait and execution time are kept per command name.
+    """
+
+    def __init__(self, name="command-worker"):
+        self.queue = []
+        self.order = itertools.count()
+        # Fair queueing: each lane's next command gets the turn after its last
+        # one, but never one that already passed, so an idle lane cannot bank
+        # turns and then run ahead of everyone.
+        self.lane_turns = {}
+        self.current_turn = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.stats = {}
+        self.thread = threading.Thread(target=self.work, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, func, *args, priority=5, coalesce_key=None, lane=None, on_coalesced=None):
+        """Queue func(*args) and return a Future for its result.
+
+        When coalesce_key is given and a command with the same name, key and lane
+        is still queued, nothing new is queued and that command's Future is returned;
+        on_coalesced() then runs on the worker right after that command.
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("CommandExecutor is shut down.")
+            if coalesce_key is not None:
+                for queued in self.queue:
+                    command = queued[-1]
+                    if (command['name'] == name and command['coalesce_key'] == coalesce_key
+                            and command['lane'] == lane):
+                        self.record(name, 'coalesced')
+                        if on_coalesced is not None:
+                            command['coalesced'].append(on_coalesced)
+                        return command['future']
+
+            future = Future()
+            command = {
+                'name': name,
+                'func': func,
+                'args': args,
+                'future': future,
+                'coalesce_key': coalesce_key,
+                'lane': lane,
+                'coalesced': [],
+                'queued_at': time.perf_counter(),
+            }
+            turn = max(self.lane_turns.get(lane, 0), self.current_turn) + 1
+            self.lane_turns[lane] = turn
+            heapq.heappush(self.queue, (priority, turn, next(self.order), command))
+            self.condition.notify()
+            return future
+
+    def cancel_queued(self, names, lane=None):
+        """Drop every queued command of the lane whose name is in names; returns how many were dropped."""
+        with self.condition:
+            kept, dropped = [], 0
+            for queued in self.queue:
+                command = queued[-1]
+                if command['name'] in names and command['lane'] == lane:
+                    command['future'].cancel()
+                    self.record(command['name'], 'cancelled')
+                    dropped += 1
+                else:
+                    kept.append(queued)
+            heapq.heapify(kept)
+            self.queue = kept
+            return dropped
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed and not self.queue:
+                    return
+                _, turn, _, command = heapq.heappop(self.queue)
+                self.current_turn = max(self.current_turn, turn)
+
+            future = command['future']
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started = time.perf_counter()
+            try:
+                result = command['func'](*command['args'])
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finished = time.perf_counter()
+            for on_coalesced in command['coalesced']:
+                try:
+                    on_coalesced()
+                except Exception as e:
+                    log.error(f"Error finishing a coalesced {command['name']}: {e}")
+
+            with self.condition:
+                self.record(command['name'], 'wait', started - command['queued_at'])
+                self.record(command['name'], 'run', finished - started)
+
+    def record(self, name, kind, seconds=None):
+        stats = self.stats.setdefault(name, {
+            'count': 0, 'wait': 0.0, 'max_wait': 0.0, 'run': 0.0, 'max_run': 0.0,
+            'coalesced': 0, 'cancelled': 0,
+        })
+        if seconds is None:
+            stats[kind] += 1
+            return
+        stats[kind] += seconds
+        stats['max_' + kind] = max(stats['max_' + kind], seconds)
+        if kind == 'run':
+            stats['count'] += 1
+
+    def summary(self):
+        """One line per command name with average and worst queue wait and run time."""
+        with self.condition:
+            lines = []
+            for name, stats in sorted(self.stats.items()):
+                count = stats['count']
+                if count:
+                    lines.append(
+                        f"{name}: {count} runs, wait {stats['wait'] / count * 1000:.0f} ms avg "
+                        f"/ {stats['max_wait'] * 1000:.0f} ms max, run {stats['run'] / count * 1000:.0f} ms avg "
+                        f"/ {stats['max_run'] * 1000:.0f} ms max, {stats['coalesced']} coalesced, "
+                        f"{stats['cancelled']} cancelled")
+                else:
+                    lines.append(
+                        f"{name}: 0 runs, {stats['coalesced']} coalesced, {stats['cancelled']} cancelled")
+            return "\n".join(lines)
+
+    def shutdown(self):
+        """Stop the worker after the commands already queued."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
@@ -1,18 +1,59 @@
-import time
 import os
+from logger import log
 # USERNAME = "Veratti"
 
 
+CONFIG_FILE = "config.txt"
+
+
+class ConfigFile:
+    """config.txt parsed once into {key: value} strings; reload() re-reads it only when its mtime changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.values = {}
+        self.load()
+
+    def load(self):
+        values = {}
+        with open(self.path, "r") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            for line in f:
+                if ":" not in line or line.lstrip().startswith("#"):
+                    continue
+                key, value = line.split(":", 1)
+                values.setdefault(key.strip(), value.strip())
+        self.values = values
+
+    def reload(self):
+        """Re-read the file if it changed since the last load; returns whether it did."""
+        try:
+            if os.stat(self.path).st_mtime == self.mtime:
+                return False
+            self.load()
+        except OSError as e:
+            log.warning(f"Error reading {self.path}: {e}")
+            return False
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+config_file = ConfigFile(CONFIG_FILE)
+
+
 def get(key):
-    with open("config.txt", "r") as f:
-        for line in f:
-            if line.startswith(f"{key}:"):
-                key_part, value_part = line.split(":", 1)
-                return value_part.strip()
-    return None
+    return config_file.get(key)
 
 
 USERNAME = get("user")
+# One game client per user, paired with the open windows left to right:
+# "users: Veratti, Zero7". Without it the bot drives one window as "user".
+# Empty if neither is set; the bot refuses to start then.
+USERNAMES = [name.strip() for name in (get("users") or "").split(",") if name.strip()] or (
+    [USERNAME] if USERNAME else [])
 SERVER = get("server")
 IP = get("ip")
 
@@ -44,8 +85,6 @@ templates = {
     "global_chat_active": global_chat_active_templates
 }
 
-print('Setup complete with', templates)
-
 # top right bottom left
 offsets = {
     "global_chat": (165, -10, -53, -186),
@@ -62,7 +101,48 @@ matcher_config = {
     "global_chat_active_templates": global_chat_active_templates,
     "offsets": offsets,
     "threshold": 0.6,
-    "overlap_threshold": 0.4
+    "overlap_threshold": 0.4,
+    # Search around the last hit of each group and only scan the whole
+    # window on a miss or every tracking_refresh_interval searches.
+    "tracking": True,
+    "tracking_margin": 40,
+    "tracking_refresh_interval": 20,
+    # Groups that can be on screen more than once, like one private chat
+    # window per conversation. They are always searched in full, since a
+    # new instance can open anywhere.
+    "multi_instance_groups": ["private_chat", "private_chat_content"],
+    # Groups matched coarse-to-fine: candidates are found at pyramid_scale
+    # and rescored at full resolution. pyramid_slack lowers the coarse
+    # threshold so matches that score a bit worse when downscaled survive.
+    # This is an approximation of the full search: a match scoring below
+    # threshold - pyramid_slack at pyramid_scale is missed, e.g. on noisy
+    # or finely detailed frames. Raise the slack, or leave the group out.
+    "pyramid_groups": ["global_chat"],
+    "pyramid_scale": 0.5,
+    "pyramid_slack": 0.15,
+    # Match results are reduced to local maxima in a peak_kernel square,
+    # keeping at most max_peaks per template, before NMS.
+    "peak_kernel": 3,
+    "max_peaks": 64,
+    # Threads used to run template matches in parallel; 1 matches inline.
+    "match_workers": 4,
+    # Worker processes for template matching, shared by all windows; 0
+    # keeps matching in this process on the match_workers threads. Worth it
+    # with several windows on a many-core host, see match_pool.py.
+    "match_processes": 0,
+    # "pil" (PIL ImageGrab), "mss" (reused buffers, needs the mss package)
+    # or "replay" (recorded PNG frames from replay_path, no game window).
+    "capture_backend": "pil",
+    "replay_path": None,
+    # Reuse the last detections of a group while its area is unchanged on a
+    # thumbnail downscaled by diff_scale (the whole frame for groups that
+    # were not found and for multi_instance_groups). diff_threshold is in
+    # gray levels. A group is matched again after diff_refresh_interval
+    # reuses in a row, and after any input the controller sends.
+    "diff_gate": True,
+    "diff_scale": 0.125,
+    "diff_threshold": 16,
+    "diff_refresh_interval": 20
 }
 
 grab_screen_offset = {
@@ -74,11 +154,225 @@ grab_screen_offset = {
 
 FETCH_INTERVAL = 5
 
+# Controller waits poll the screen every WAIT_POLL_INTERVAL seconds for a
+# visual confirmation and give up after WAIT_TIMEOUT, the old fixed sleep.
+WAIT_TIMEOUT = 0.5
+WAIT_POLL_INTERVAL = 0.03
+
+# Periodic private chat crops that look the same as the last ones sent are
+# replaced by an "unchanged" marker. tolerance is in gray levels on the
+# crop downscaled by scale.
+crop_dedup = {
+    "enabled": True,
+    "scale": 0.25,
+    "tolerance": 12
+}
+
+# How chat crops are encoded (encoder.py). "auto" picks a grayscale PNG or
+# a JPEG per crop, "jpeg" always sends JPEG. JPEG quality steps down
+# quality_levels while more than budget bytes per second were encoded over
+# the last window seconds; with budget None the budget is headroom times
+# the measured upload speed. workers threads encode in parallel.
+crop_encoding = {
+    "mode": "auto",
+    "quality_levels": [95, 80, 65, 50, 35],
+    "palette_levels": 16,
+    "flat_ratio": 0.9,
+    "gray_tolerance": 12,
+    "png_preference": 1.25,
+    "budget": None,
+    "headroom": 0.8,
+    "window": 10,
+    "workers": 2
+}
+
+# Send global chat and private chat content crops as text read with the
+# game's bitmap font (ocr.py, glyph cells in the glyphs directory) when
+# every line reads with at least min_confidence; otherwise as images.
+# glyph_threshold is the lowest score a glyph is accepted with. The game
+# smooths glyph edges, so each line is thresholded at ink_ratio of its
+# brightest pixel. areas (x, y, w, h) is the message pane inside a crop of
+# a template group, leaving out the window frame and scroll bar; it
+# follows the group's offsets above. The global_chat one was measured on
+# real crops; the private_chat_content one only leaves out the scroll bar
+# its template matches and is not checked against a capture yet.
+# benchmarks/ocr_fixtures/glyphs holds the glyphs learned so far.
+ocr = {
+    "enabled": False,
+    "glyphs": "glyphs",
+    "min_confidence": 0.9,
+    "glyph_threshold": 0.8,
+    "ink_threshold": None,
+    "ink_ratio": 0.64,
+    "areas": {
+        "global_chat": (200, 4, 366, 131),
+        "private_chat_content": (0, 0, 365, 288)
+    }
+}
+
+# Auto chat campaigns never send more often than min_interval seconds each;
+# across all campaigns sends are min_gap seconds apart and at most
+# max_per_minute in any minute.
+auto_chat = {
+    "min_interval": 2.0,
+    "min_gap": 1.0,
+    "max_per_minute": 20
+}
+
+# Per-stage latency histograms (metrics.py). When enabled they are served in
+# Prometheus text format on 127.0.0.1:port/metrics and, with a dump_path,
+# written there as JSON every dump_interval seconds.
+metrics = {
+    "enabled": False,
+    "port": 9108,
+    "dump_path": None,
+    "dump_interval": 60
+}
+
+
+# Match every template once during startup, before the first command.
+WARM_UP = True
+
 
-log_file = open("log", "a")
+def parse_bool(value):
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def ranged(parse, low=None, high=None):
+    """Wrap a parser so values below low or above high are rejected."""
+    def parse_ranged(value):
+        value = parse(value)
+        if (low is not None and value < low) or (high is not None and value > high):
+            bounds = f"from {low} to {high}" if high is not None else f"at least {low}"
+            raise ValueError(f"expected a value {bounds}: {value}")
+        return value
+    return parse_ranged
+
+
+def parse_groups(value):
+    groups = parse_list(value)
+    unknown = [name for name in groups if name not in templates]
+    if unknown:
+        raise ValueError(f"unknown template groups: {', '.join(unknown)}")
+    return groups
+
+
+def parse_encoding_mode(value):
+    if value not in ("auto", "jpeg"):
+        raise ValueError(f"expected auto or jpeg: {value}")
+    return value
+
+
+def parse_offsets(value):
+    offset = tuple(int(item) for item in value.split(","))
+    if len(offset) != 4:
+        raise ValueError(f"expected top,right,bottom,left: {value}")
+    return offset
+
+
+# Keys of config.txt that tune the running bot and the settings they
+# override. They are picked up by reload() without a restart; see
+# TemplateMatcher.apply_settings. Each parser rejects values out of range,
+# and a rejected edit keeps the value in use. Offsets are given per group as
+# "offset_<group>: top,right,bottom,left".
+TUNABLE_KEYS = {
+    "threshold": (matcher_config, "threshold", ranged(float, 0.0, 1.0)),
+    "overlap_threshold": (matcher_config, "overlap_threshold", ranged(float, 0.0, 1.0)),
+    "tracking": (matcher_config, "tracking", parse_bool),
+    "tracking_margin": (matcher_config, "tracking_margin", ranged(int, 0)),
+    "tracking_refresh_interval": (matcher_config, "tracking_refresh_interval", ranged(int, 0)),
+    "pyramid_groups": (matcher_config, "pyramid_groups", parse_groups),
+    "pyramid_scale": (matcher_config, "pyramid_scale", ranged(float, 0.05, 1.0)),
+    "pyramid_slack": (matcher_config, "pyramid_slack", ranged(float, 0.0, 1.0)),
+    "peak_kernel": (matcher_config, "peak_kernel", ranged(int, 1, 31)),
+    "max_peaks": (matcher_config, "max_peaks", ranged(int, 1)),
+    "diff_gate": (matcher_config, "diff_gate", parse_bool),
+    "diff_scale": (matcher_config, "diff_scale", ranged(float, 0.01, 1.0)),
+    "diff_threshold": (matcher_config, "diff_threshold", ranged(int, 0, 255)),
+    "diff_refresh_interval": (matcher_config, "diff_refresh_interval", ranged(int, 0)),
+    "auto_chat_min_interval": (auto_chat, "min_interval", ranged(float, 0.0)),
+    "auto_chat_min_gap": (auto_chat, "min_gap", ranged(float, 0.0)),
+    "auto_chat_max_per_minute": (auto_chat, "max_per_minute", ranged(int, 1)),
+    "crop_encoding": (crop_encoding, "mode", parse_encoding_mode),
+    "upload_budget": (crop_encoding, "budget", ranged(int, 0)),
+    "ocr_min_confidence": (ocr, "min_confidence", ranged(float, 0.0, 1.0)),
+}
+for _name in offsets:
+    TUNABLE_KEYS[f"offset_{_name}"] = (offsets, _name, parse_offsets)
+# Module-level timings are set on this module.
+TUNABLE_GLOBALS = {
+    "wait_timeout": ("WAIT_TIMEOUT", ranged(float, 0.0)),
+    "wait_poll_interval": ("WAIT_POLL_INTERVAL", ranged(float, 0.001)),
+}
+
+# The values above as written in this file, used for keys that are removed
+# from config.txt again.
+defaults = {key: target[name] for key, (target, name, _) in TUNABLE_KEYS.items()}
+defaults.update({key: globals()[name] for key, (name, _) in TUNABLE_GLOBALS.items()})
+
+
+def apply_file():
+    """Apply the tunable keys of config.txt over the defaults; returns the keys whose value changed.
+
+    Settings are updated in place, so code holding matcher_config, offsets or
+    auto_chat sees the new values. A value that does not parse, or is out of
+    range, is reported and the current value stays.
+    """
+    changed = []
+    for key, default in defaults.items():
+        value = default
+        raw = config_file.get(key)
+        if raw is not None:
+            parse = TUNABLE_KEYS[key][2] if key in TUNABLE_KEYS else TUNABLE_GLOBALS[key][1]
+            try:
+                value = parse(raw)
+            except ValueError as e:
+                log.warning(f"Ignoring {key} in {CONFIG_FILE}: {e}")
+                continue
+        if key in TUNABLE_KEYS:
+            target, name, _ = TUNABLE_KEYS[key]
+            if target[name] != value:
+                target[name] = value
+                changed.append(key)
+        else:
+            name = TUNABLE_GLOBALS[key][0]
+            if globals()[name] != value:
+                globals()[name] = value
+                changed.append(key)
+    return changed
+
+
+def reload():
+    """Re-read config.txt if its mtime changed and apply it; returns the keys that changed."""
+    if not config_file.reload():
+        return []
+    return apply_file()
+
+
+apply_file()
+
+# Logging (logger.py): records at level and above go to the rotating log
+# file, console_level and above also to the console. A message that can
+# repeat every tick, e.g. a failed capture, is logged once per
+# repeat_window seconds.
+log_settings = {
+    "file": "log",
+    "level": "DEBUG",
+    "console_level": "INFO",
+    "max_bytes": 5_000_000,
+    "backup_count": 3,
+    "repeat_window": 30
+}
 
 
 def log_info(message):
-    message = f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}"
-    log_file.write(message + "\n")
-    log_file.flush()
+    """Detail for the log file only, such as step timings."""
+    log.debug(message)
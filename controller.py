@@ -7,33 +7,106 @@ import pygetwindow as gw
 import cv2
 import numpy as np
 import os
+import config
+import metrics
+from crop_dedup import CropDeduplicator
+from logger import log
+from step_stats import StepStats
 os.environ['AUTOIT_DLL_PATH'] = "C:\\Program Files(x86)\\AutoIt3\\AutoItX\\AutoItX3.dll"
 
 pydirectinput.PAUSE = 0.1
 pydirectinput.HOTKEYS = True
 
 
-class Controller:
+class UIState:
+    """What the controller believes the game UI looks like; None means unknown."""
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self.chat_input_open = None
+        self.private_windows = None
+        self.focused = None
+
+    def set_clean(self):
+        """No chat input or private window open, game window focused."""
+        self.chat_input_open = False
+        self.private_windows = 0
+        self.focused = True
+
+    def is_clean(self):
+        return (self.chat_input_open is False and self.private_windows == 0
+                and self.focused is True)
+
+
+class Controller(StepStats):
     def __init__(self, screen, matcher):
         self.chat_open = False
+        self.ui = UIState()
         self.screen = screen
         self.matcher = matcher
-        self.window = self.matcher.get_window()
+        self.window = self.matcher.window
         self.center_x = self.window.left + self.window.width // 2
         self.center_y = self.window.top + self.window.height // 2 + 80
+        # label -> {'count', 'seconds', 'max', 'timeouts'} for waits and whole flows
+        self.step_stats = {}
+        # Tells when a sent message shows up in a private chat window.
+        self.chat_signatures = CropDeduplicator(config.crop_dedup["scale"], config.crop_dedup["tolerance"])
+
+    def wait_for(self, label, predicate, timeout=None):
+        """Poll a cheap visual predicate until it holds or the timeout passes.
+
+        Returns whether the predicate held. On a timeout the caller carries on as
+        it did with the old fixed sleep, which the timeout replaces. The time
+        spent is logged under label.
+        """
+        timeout = config.WAIT_TIMEOUT if timeout is None else timeout
+        # Every wait follows input, so no detection from before it may be reused.
+        self.input_sent()
+        start = time.perf_counter()
+        while True:
+            try:
+                held = predicate()
+            except Exception as e:
+                log.error(f"Error checking '{label}': {e}")
+                held = False
+            elapsed = time.perf_counter() - start
+            if held or elapsed >= timeout:
+                break
+            time.sleep(config.WAIT_POLL_INTERVAL)
+        self.record_step(label, elapsed, held)
+        return held
+
+    def template_count(self, template_name):
+        """Number of detections of a template group on a fresh capture."""
+        return len(self.matcher.detect_template(template_name))
+
+    def private_chat_snapshot(self):
+        """(coordinates, signature) of every open private chat window on a fresh capture."""
+        return [(crop['coordinates'], self.chat_signatures.signature(crop['image']))
+                for crop in self.matcher.detect_template('private_chat_content')]
+
+    def private_chat_changed(self, before):
+        """Whether the open private chat windows look different from a private_chat_snapshot."""
+        after = self.private_chat_snapshot()
+        return len(after) != len(before) or not all(
+            self.chat_signatures.same(previous, coords, signature)
+            for previous, (coords, signature) in zip(before, after))
+
+    def input_sent(self):
+        """Drop the matcher's diff gate cache: the view may have changed without the thumbnail showing it."""
+        self.matcher.reset_gate()
 
     def focus_window(self):
         """Focuses the game window."""
         try:
-            windows = gw.getWindowsWithTitle(self.matcher.window_title)
-            if not windows:
-                print(
-                    f"Error: Window titled '{self.matcher.window_title}' not found.")
-                return False
-
-            window = windows[0]
-            print(f"Attempting to focus window: {window.title}")
+            # The matcher's own window: with several clients open, every one
+            # of them has the same title.
+            window = self.window
+            log.debug(f"Attempting to focus window: {window.title}")
             window.activate()
+            self.ui.focused = True
             # time.sleep(0.5)
 
             # x, y = window.left + 10, window.top + 10
@@ -45,51 +118,105 @@ class Controller:
             # time.sleep(0.5)
             return True
         except Exception as e:
-            print(f"Error focusing window: {e}")
+            log.error(f"Error focusing window: {e}")
+            self.ui.focused = None
             return False
 
-    def reset_view(self, screen):
-        self.screen = screen
+    def ensure_clean_view(self, frame=None):
+        """Make sure no private chat or chat input is open, running the full reset_view only when needed.
+
+        When the tracked UI state says the view is already clean, one capture
+        confirms it (the two groups are matched together on the same frame) and
+        the reset's clicks and waits are skipped.
+        """
+        if self.ui.is_clean():
+            start = time.perf_counter()
+            if frame is None:
+                frame = self.matcher.capture_frame()
+            if frame is not None and self.view_matches_state(frame):
+                self.record_step('view verified', time.perf_counter() - start)
+                return
+            log.warning("Tracked UI state is stale, resetting view.")
+            self.ui.invalidate()
+            frame = None
+        self.reset_view(frame)
+
+    def view_matches_state(self, frame):
+        """Check the frame and the focused window against the tracked UI state."""
+        detections = self.matcher.detect_many(
+            frame, ['private_chat_content', 'global_chat_active'])
+        return (len(detections['private_chat_content']) == self.ui.private_windows
+                and bool(detections['global_chat_active']) == self.ui.chat_input_open
+                and self.is_window_focused() == self.ui.focused)
+
+    def reset_view(self, frame=None):
+        """Close private chats and the chat input. Detections on the passed frame are reused until the view changes."""
+        start = time.perf_counter()
+        confirmed = True
         autoit.mouse_click(
             "left", self.matcher.window_position['left'] +
             10, self.matcher.window_position['top'] + 10, 3
         )
 
-        private_chats = self.matcher.detect_template('private_chat_content')
-        print("Open Private Chats:", len(private_chats))
+        if frame is None:
+            frame = self.matcher.capture_frame()
+
+        detections = {}
+        if frame is not None:
+            detections = self.matcher.detect_many(
+                frame, ['private_chat_content', 'global_chat_active'])
+
+        private_chats = detections.get('private_chat_content', [])
+        log.debug(f"Open Private Chats: {len(private_chats)}")
 
         if len(private_chats) > 0:
-            for chat in private_chats:
+            for remaining in range(len(private_chats) - 1, -1, -1):
                 pydirectinput.press('esc')
-                time.sleep(0.5)
-
-        global_chat_active = self.matcher.detect_template('global_chat_active')
+                confirmed &= self.wait_for(
+                    'private chat closed',
+                    lambda: self.template_count('private_chat_content') <= remaining)
+            frame = None
+
+        if frame is not None:
+            global_chat_active = detections['global_chat_active']
+        else:
+            global_chat_active = self.matcher.detect_template(
+                'global_chat_active')
         if len(global_chat_active) > 0:
             pydirectinput.press('enter')
-            time.sleep(0.5)
-            print("Opened Global Chat")
+            log.debug("Opened Global Chat")
 
-            global_chat_active_inner = self.matcher.detect_template(
-                'global_chat_active')
-            if len(global_chat_active_inner) > 0:
-                print("Global Chat - Inner")
+            closed = self.wait_for(
+                'chat input closed',
+                lambda: self.template_count('global_chat_active') == 0)
+            if not closed:
+                log.debug("Global Chat - Inner")
                 pydirectinput.press('enter')
-                time.sleep(0.5)
+                confirmed &= self.wait_for(
+                    'chat input closed',
+                    lambda: self.template_count('global_chat_active') == 0)
 
         autoit.mouse_click("left", self.center_x, self.center_y, 10)
-        print("View reset completed.")
+        self.input_sent()
+        if confirmed:
+            self.ui.set_clean()
+        else:
+            self.ui.invalidate()
+        self.record_step('reset_view', time.perf_counter() - start)
+        log.debug("View reset completed.")
 
     def is_window_focused(self):
         """Checks if the game window is currently focused."""
         try:
             active_window = gw.getActiveWindow()
+            focused = False
             if active_window:
-                active_title = active_window.title.strip()
-                if active_title == self.matcher.window_title.strip():
-                    return True
-            return False
+                focused = active_window._hWnd == self.window._hWnd
+            if not focused:
+                self.ui.focused = False
+            return focused
         except Exception as e:
-            print(f"Error checking focused window: {e}")
+            log.error(f"Error checking focused window: {e}")
             return False
 
     def visualize_coordinates(self, screen, x, y, w, h):
@@ -118,37 +245,49 @@ class Controller:
         except Exception as e:
             print(f"Error visualizing coordinates: {e}")
 
-    def send_global_chat(self, message):
+    def send_global_chat(self, message, frame=None):
         """Sends a message to the chat input."""
         if not self.is_window_focused():
             if not self.focus_window():
-                print("Unable to focus the game window. Cannot send message.")
+                log.warning("Unable to focus the game window. Cannot send message.")
                 return
 
         try:
-
-            self.reset_view(self.screen)
+            start = time.perf_counter()
+            self.ensure_clean_view(frame)
 
             pyperclip.copy(message)
 
             pydirectinput.press('enter')
-            time.sleep(0.5)
+            opened = self.wait_for(
+                'chat input open',
+                lambda: self.template_count('global_chat_active') > 0)
 
+            # pydirectinput.PAUSE already spaces out the key presses.
             pydirectinput.press('backspace')
-            time.sleep(0.1)
 
             apply_hotkeys('ctrl', 'v')
-            print(f"Pasted message: {message}")
+            log.debug(f"Pasted message: {message}")
 
             pydirectinput.press('enter')
-            print(f"Message sent: {message}")
+            log.info(f"Message sent: {message}")
+            # Sending closes the chat input again. If it never showed as
+            # open, the state is unclear and the next send resets the view.
+            if opened:
+                self.ui.chat_input_open = False
+            else:
+                self.ui.invalidate()
+            self.record_step('send_global_chat', time.perf_counter() - start)
         except Exception as e:
-            print(f"Error sending message: {e}")
+            self.ui.invalidate()
+            log.error(f"Error sending message: {e}")
+        finally:
+            self.input_sent()
 
     def send_private_chat(self, coords, message):
         if not self.is_window_focused():
             if not self.focus_window():
-                print("Unable to focus the game window. Cannot send message.")
+                log.warning("Unable to focus the game window. Cannot send message.")
                 return
 
         try:
@@ -164,71 +303,96 @@ class Controller:
 
             pyautogui.moveTo(x, y)
 
+            start = time.perf_counter()
             middle_y = y + h // 2
             middle_x = x + w - 20
+            # Other private chats may be open already; only a new window confirms the click.
+            open_windows = self.template_count('private_chat_content')
             autoit.mouse_click("left", middle_x, middle_y, 3)
-            time.sleep(0.5)
-            print(f"Opened private chat box.")
+            self.wait_for(
+                'private chat open',
+                lambda: self.template_count('private_chat_content') > open_windows)
+            log.debug(f"Opened private chat box.")
+
+            # pyperclip.copy is synchronous and pydirectinput.PAUSE already
+            # spaces out the key presses.
             pyperclip.copy(message)
-            time.sleep(0.5)
             pydirectinput.press('backspace')
-            time.sleep(0.5)
 
             apply_hotkeys('ctrl', 'v')
-            print(f"Pasted message: {message}")
-            time.sleep(0.5)
+            log.debug(f"Pasted message: {message}")
 
+            before = self.private_chat_snapshot()
             pydirectinput.press('enter')
-            time.sleep(0.5)
-
-            print(f"Message sent: {message}")
+            # The message moves from the input line into the chat; closing
+            # the window before that could drop it.
+            if self.wait_for('private message sent', lambda: self.private_chat_changed(before)):
+                log.info(f"Message sent: {message}")
+            else:
+                log.warning(f"Message not confirmed as sent: {message}")
 
             pydirectinput.press('esc')
-
-            time.sleep(0.5)
+            closed = self.wait_for(
+                'private chat closed',
+                lambda: self.template_count('private_chat_content') <= open_windows)
 
             autoit.mouse_click("left", self.center_x, self.center_y, 3)
+            if closed and self.ui.chat_input_open is False:
+                self.ui.private_windows = open_windows
+            else:
+                self.ui.invalidate()
+            self.record_step('send_private_chat', time.perf_counter() - start)
 
         except Exception as e:
-            print(f"Error sending private message: {e}")
+            log.error(f"Error sending private message: {e}")
+        finally:
+            self.input_sent()
 
     def send_private_chat_2(self, message, coords=None):
         """Chat box is already open."""
         if not self.is_window_focused():
             if not self.focus_window():
-                print("Unable to focus the game window. Cannot send message.")
+                log.warning("Unable to focus the game window. Cannot send message.")
                 return
 
         try:
             x, y, w, h = coords['x'], coords['y'], coords['w'], coords['h']
             x, y, w, h = int(x), int(y), int(w), int(h)
 
+            start = time.perf_counter()
             self.click_on_point(coords, 5)
 
+            # pyautogui and pydirectinput pause after every call on their
+            # own and pyperclip.copy is synchronous.
             pyautogui.moveTo(x, y)
-            time.sleep(0.1)
             pyperclip.copy(message)
-            time.sleep(0.1)
             pydirectinput.press('backspace')
-            time.sleep(0.1)
             apply_hotkeys('ctrl', 'v')
-            print(f"Pasted message: {message}")
-            time.sleep(0.1)
+            log.debug(f"Pasted message: {message}")
+            before = self.private_chat_snapshot()
             pydirectinput.press('enter')
-            time.sleep(0.1)
-            print(f"Message sent: {message}")
+            # This path used to sleep 0.1 s here, not WAIT_TIMEOUT.
+            if self.wait_for('private message sent', lambda: self.private_chat_changed(before), timeout=0.1):
+                log.info(f"Message sent: {message}")
+            else:
+                log.warning(f"Message not confirmed as sent: {message}")
 
             pydirectinput.press('enter')
-            time.sleep(0.1)
+            # A private chat window stays open; which state it leaves the
+            # chat input in is not checked, so force a reset next time.
+            self.ui.invalidate()
+            self.record_step('send_private_chat_2', time.perf_counter() - start)
 
         except Exception as e:
-            print(f"Error sending private message: {e}")
+            log.error(f"Error sending private message: {e}")
+        finally:
+            self.input_sent()
 
     def click_on_point(self, coords, times, offset=[0, 0]):
         """This function gets the center of the point and then clicks on it after applying x and y offsets."""
         if not self.is_window_focused():
             if not self.focus_window():
-                print("Unable to focus the game window. Cannot click on point.")
+                log.warning("Unable to focus the game window. Cannot click on point.")
                 return
 
         try:
@@ -246,18 +410,21 @@ class Controller:
 
             x_final = x_centered + offset[0]
             y_final = y_centered + offset[1]
-            autoit.mouse_click("left", x_final, y_final, times)
+            with metrics.timer('input:click'):
+                autoit.mouse_click("left", x_final, y_final, times)
+            self.ui.invalidate()
+            self.input_sent()
 
             # autoit.mouse_click("left", x_final, y_final, times)
-            print(f"Clicked on point.")
+            log.debug(f"Clicked on point.")
 
         except Exception as e:
-            print(f"Error clicking on point: {e}")
+            log.error(f"Error clicking on point: {e}")
 
     def drag_and_drop_2(self, start_coords, end_coords):
         if not self.is_window_focused():
             if not self.focus_window():
-                print("Unable to focus the game window. Cannot drag and drop.")
+                log.warning("Unable to focus the game window. Cannot drag and drop.")
                 return
 
         try:
@@ -274,12 +441,15 @@ class Controller:
             adjusted_end_x = end_x + offset_x - 21
             adjusted_end_y = end_y + offset_y + 25
 
-            autoit.mouse_click_drag(
-                "left", adjusted_start_x, adjusted_start_y, adjusted_end_x, adjusted_end_y, speed=10)
-            print(
+            with metrics.timer('input:drag'):
+                autoit.mouse_click_drag(
+                    "left", adjusted_start_x, adjusted_start_y, adjusted_end_x, adjusted_end_y, speed=10)
+            self.ui.invalidate()
+            self.input_sent()
+            log.debug(
                 f"Dragged from ({adjusted_start_x}, {adjusted_start_y}) to ({adjusted_end_x}, {adjusted_end_y})")
         except Exception as e:
-            print(f"Error occurred while performing drag and drop: {e}")
+            log.error(f"Error occurred while performing drag and drop: {e}")
 
 
 def apply_hotkeys(key1, key2):
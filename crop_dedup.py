@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+from frame import to_gray
+
+
+class CropDeduplicator:
+    """Spots crops that look the same as the last one sent from the same slot.
+
+    Each crop is reduced to a small grayscale signature (downscaled with area
+    averaging, which smooths out capture and rendering noise). A crop counts as
+    unchanged when it sits at the same coordinates and no signature pixel moved
+    by more than tolerance gray levels; a new line of chat text shifts whole
+    blocks of the signature, well past that.
+    """
+
+    def __init__(self, scale=0.25, tolerance=12):
+        self.scale = scale
+        self.tolerance = tolerance
+        # (message type, slot index) -> (coordinates, signature)
+        self.sent = {}
+
+    def signature(self, image):
+        """Downscaled grayscale copy of a crop."""
+        gray = to_gray(image)
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                          interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def filter(self, message_type, crops):
+        """Return crops with unchanged ones replaced by {'coordinates', 'unchanged': True} markers."""
+        filtered = []
+        for index, crop_data in enumerate(crops):
+            key = (message_type, index)
+            coords = crop_data['coordinates']
+            signature = self.signature(crop_data['image'])
+            previous = self.sent.get(key)
+            if previous is not None and self.same(previous, coords, signature):
+                filtered.append({'coordinates': coords, 'unchanged': True})
+                continue
+            self.sent[key] = (coords, signature)
+            filtered.append(crop_data)
+
+        for key in [key for key in self.sent if key[0] == message_type and key[1] >= len(crops)]:
+            del self.sent[key]
+        return filtered
+
+    def same(self, previous, coords, signature):
+        previous_coords, previous_signature = previous
+        if previous_coords != coords or previous_signature.shape != signature.shape:
+            return False
+        return int(np.abs(previous_signature - signature).max()) <= self.tolerance
+
+    def reset(self):
+        """Forget everything sent, so the next crops go out in full."""
+        self.sent.clear()
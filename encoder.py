@@ -0,0 +1,209 @@
+"""Encodes chat crops as PNG or JPEG, whichever suits each, at a JPEG quality that fits the upload budget."""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import metrics
+from logger import log
+
+# Sends smaller than this finish as soon as they are buffered, so they say
+# nothing about the link speed.
+MIN_MEASURED_SEND = 32 * 1024
+
+
+class CropEncoder:
+    """Chooses a format for each crop, encodes crops on a thread pool and adapts JPEG quality to a bandwidth budget.
+
+    Mostly flat crops become palette PNGs when those are not much bigger than
+    the JPEG. JPEG quality steps down while the recent byte rate is over the
+    budget, and back up once it is under half of it.
+    """
+
+    def __init__(self, mode="auto", quality_levels=(95, 80, 65, 50, 35), palette_levels=16,
+                 flat_ratio=0.9, gray_tolerance=12, png_preference=1.25, budget=None,
+                 headroom=0.8, window=10, workers=2):
+        self.mode = mode
+        self.quality_levels = list(quality_levels)
+        self.palette_levels = palette_levels
+        self.flat_ratio = flat_ratio
+        self.gray_tolerance = gray_tolerance
+        self.png_preference = png_preference
+        self.budget = budget
+        self.headroom = headroom
+        self.window = window
+        self.workers = workers
+
+        self.level = 0
+        # No further level change before this time, so the rate after a change is measured first.
+        self.settle_until = 0.0
+        self.link_speed = None
+        self.recent = deque()
+        self.lock = threading.Lock()
+        self.pool = None
+        self.sender = None
+        # Last deferred message per key, and how many were skipped behind one.
+        self.pending = {}
+        self.skipped_sends = 0
+        self.stats = {}
+
+    def get_pool(self):
+        """Thread pool for the encodes, created on first use."""
+        if self.workers <= 1:
+            return None
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encode")
+        return self.pool
+
+    def busy(self, key):
+        """Whether the message last deferred under key is still queued or sending; counts a skipped send if so."""
+        future = self.pending.get(key)
+        if future is None or future.done():
+            return False
+        with self.lock:
+            self.skipped_sends += 1
+        return True
+
+    def defer(self, key, func, *args):
+        """Run func(*args) on the sender thread, so the caller can capture the next frame meanwhile.
+
+        Check busy(key) first: a message skipped behind one still in flight
+        would be stale by the time it went out. Deferred messages go out in
+        the order given.
+        """
+        if self.sender is None:
+            self.sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix="send")
+        future = self.sender.submit(func, *args)
+        future.add_done_callback(self.report_failure)
+        self.pending[key] = future
+        return future
+
+    @staticmethod
+    def report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error(f"Error in deferred send: {future.exception()}")
+
+    def encode_many(self, images):
+        """Encode several crops, in parallel on the pool; returns a (format, bytes) pair per image."""
+        pool = self.get_pool()
+        if pool is None or len(images) < 2:
+            return [self.encode(image) for image in images]
+        return list(pool.map(self.encode, images))
+
+    def encode(self, image):
+        """Encode one crop; returns (format, bytes), format being 'jpeg' or 'png'."""
+        start = time.perf_counter()
+        quality = self.quality_levels[self.level]
+        colorless = self.is_colorless(image)
+        if colorless or self.level == len(self.quality_levels) - 1:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        image_format, data = 'jpeg', self.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if self.mode == "auto":
+            reduced = self.reduce_palette(image)
+            if reduced is not None:
+                png = self.imencode('.png', reduced, [cv2.IMWRITE_PNG_COMPRESSION, 6])
+                if len(png) <= len(data) * self.png_preference:
+                    image_format, data = 'png', png
+
+        seconds = time.perf_counter() - start
+        metrics.observe('encode', seconds)
+        self.record(image_format, len(data), seconds)
+        return image_format, data
+
+    @staticmethod
+    def imencode(extension, image, params):
+        _, encoded = cv2.imencode(extension, image, params)
+        return encoded.tobytes()
+
+    def is_colorless(self, image):
+        """Whether the crop is gray already: channels differ by less than gray_tolerance on average."""
+        if image.ndim == 2:
+            return True
+        spread = image.max(axis=2).astype(np.int16) - image.min(axis=2)
+        return float(spread.mean()) < self.gray_tolerance
+
+    def reduce_palette(self, image):
+        """Return the crop quantized to a small palette if most of it already uses one, else None."""
+        levels = self.palette_levels
+        step = 256 // levels
+        quantized = image // step
+        if image.ndim == 2:
+            counts = np.bincount(quantized.ravel(), minlength=levels)
+        else:
+            codes = (quantized[..., 0].astype(np.int32) * levels + quantized[..., 1]) * levels + quantized[..., 2]
+            counts = np.bincount(codes.ravel())
+        counts.sort()
+        if counts[-levels:].sum() < self.flat_ratio * quantized.shape[0] * quantized.shape[1]:
+            return None
+        return (quantized * step + step // 2).astype(np.uint8)
+
+    def record(self, image_format, size, seconds):
+        now = time.monotonic()
+        with self.lock:
+            stats = self.stats.setdefault(image_format, {'crops': 0, 'bytes': 0, 'seconds': 0.0})
+            stats['crops'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+            self.recent.append((now, size))
+            self.adapt(now)
+
+    def record_send(self, size, seconds):
+        """Feed the link speed estimate with the size and duration of a send."""
+        if size < MIN_MEASURED_SEND or seconds <= 0:
+            return
+        speed = size / seconds
+        with self.lock:
+            self.link_speed = speed if self.link_speed is None else 0.8 * self.link_speed + 0.2 * speed
+
+    def current_budget(self):
+        if self.budget:
+            return self.budget
+        if self.link_speed:
+            return self.link_speed * self.headroom
+        return None
+
+    def adapt(self, now):
+        """Step the quality level down while over budget and back up when well under it; called with the lock held."""
+        while self.recent and self.recent[0][0] <= now - self.window:
+            self.recent.popleft()
+        budget = self.current_budget()
+        if budget is None or now < self.settle_until:
+            return
+        rate = sum(size for _, size in self.recent) / self.window
+        if rate > budget and self.level < len(self.quality_levels) - 1:
+            self.level += 1
+            self.settle_until = now + self.window
+            log.info(f"Crop encoding over budget ({rate:.0f} > {budget:.0f} B/s), "
+                     f"JPEG quality {self.quality_levels[self.level]}.")
+        elif rate < budget / 2 and self.level > 0:
+            self.level -= 1
+            self.settle_until = now + self.window
+            log.info(f"Crop encoding under budget ({rate:.0f} < {budget:.0f} B/s), "
+                     f"JPEG quality {self.quality_levels[self.level]}.")
+
+    def gauge(self):
+        """Crops, bytes and encode time per format, for metrics.register_gauge."""
+        with self.lock:
+            values = {f"{image_format}_{key}": value
+                      for image_format, stats in self.stats.items() for key, value in stats.items()}
+        values['quality'] = self.quality_levels[self.level]
+        values['skipped_sends'] = self.skipped_sends
+        return values
+
+    def summary(self):
+        with self.lock:
+            parts = [f"{image_format}: {stats['crops']} crops, {stats['bytes'] / stats['crops']:.0f} B/crop, "
+                     f"{stats['seconds'] / stats['crops'] * 1000:.2f} ms/crop"
+                     for image_format, stats in sorted(self.stats.items())]
+        budget = self.current_budget()
+        budget = f"{budget:.0f} B/s" if budget else "none"
+        return (f"{'; '.join(parts) or 'no crops'}; quality {self.quality_levels[self.level]}, budget {budget}, "
+                f"{self.skipped_sends} sends skipped")
+
+    def shutdown(self):
+        if self.sender is not None:
+            self.sender.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
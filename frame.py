@@ -0,0 +1,51 @@
+import time
+import cv2
+import metrics
+
+
+def to_gray(image):
+    """Convert a BGR/BGRA image to grayscale, passing grayscale images through."""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class Frame:
+    """A single capture of the game window, shared by everything that runs in one tick."""
+
+    def __init__(self, image, window_position, top_center, timestamp=None):
+        self.image = image
+        self.window_position = window_position
+        self.top_center = top_center
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.height, self.width = image.shape[:2]
+        # Detections (cropped images) and their boxes after NMS are memoized
+        # per template group, so asking twice for the same group on the same
+        # frame costs nothing.
+        self.detections = {}
+        self.boxes = {}
+        self._gray = None
+        self._thumbnails = {}
+
+    @property
+    def gray(self):
+        """Grayscale view of the frame, converted on first use."""
+        if self._gray is None:
+            with metrics.timer('grayscale'):
+                self._gray = to_gray(self.image)
+        return self._gray
+
+    def thumbnail(self, scale):
+        """Heavily downscaled grayscale copy, for cheap frame-to-frame comparisons."""
+        thumbnail = self._thumbnails.get(scale)
+        if thumbnail is None:
+            thumbnail = cv2.resize(self.gray, None, fx=scale, fy=scale,
+                                   interpolation=cv2.INTER_AREA)
+            self._thumbnails[scale] = thumbnail
+        return thumbnail
+
+    @property
+    def bbox(self):
+        """Captured area in screen coordinates as (left, top, right, bottom)."""
+        left, top = self.window_position['left'], self.window_position['top']
+        return left, top, left + self.width, top + self.height
@@ -0,0 +1,4 @@
+"""Imported first by knight_chat_bot, so STARTED is when its imports began."""
+import time
+
+STARTED = time.perf_counter()
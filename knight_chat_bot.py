@@ -1,19 +1,23 @@
-import threading
+import import_clock  # first, to time the imports below
 import time
-import websocket
+import argparse
+import contextlib
 import shutil
 import json
 import zipfile
 import base64
-import cv2
 import config
-from template_matcher import TemplateMatcher
-from controller import Controller
-import requests
+from protocol import pack_message
+import metrics
+import logger
+from logger import log
 import subprocess
 import sys
 import os
-import sys
+
+# OpenCV/NumPy (matcher), asyncio and websockets (client), requests (updater)
+# and the Windows input libraries (controller) are imported where they are
+# first needed, so importing this module stays cheap and side-effect free.
 
 if getattr(sys, 'frozen', False):
     app_path = os.path.dirname(sys.executable)
@@ -24,15 +28,6 @@ app_path = os.path.abspath(os.path.join(app_path, '..'))
 
 autoit_dll_path = os.path.join(app_path, 'autoit', 'lib', 'AutoItX3_x64.dll')
 
-if os.path.exists(autoit_dll_path):
-    os.environ['AUTOIT_X64_DLL'] = autoit_dll_path
-else:
-    print(f"Error: {autoit_dll_path} not found.")
-if os.path.exists(autoit_dll_path):
-    os.environ['AUTOIT_X64_DLL'] = autoit_dll_path
-else:
-    print(f"Error: {autoit_dll_path} not found.")
-
 
 REPO_OWNER = 'msbrdmr'
 REPO_NAME = 'KO_AutoMessenger'
@@ -51,67 +46,213 @@ EXTRACT_DIR = os.path.join(os.getcwd(), "dist")
 config_file = os.path.join(os.getcwd(), "config.txt")
 IP = config.IP
 SERVER_URL = IP
+# "binary" sends chat crops as binary frames (see protocol.py); anything
+# else keeps the JSON messages with base64 images.
+BINARY_PROTOCOL = config.get("protocol") == "binary"
+
+
+class Session:
+    """One game window and everything driving it: its matcher, controller, client and auto chat scheduler."""
+
+    def __init__(self, username, matcher, controller, crop_deduplicator=None):
+        self.username = username
+        self.matcher = matcher
+        self.controller = controller
+        self.crop_deduplicator = crop_deduplicator
+        self.client = None
+        self.scheduler = None
+
+
+sessions = []
+# match_pool.MatchPool shared by every session's matcher, if configured.
+process_pool = None
+# encoder.CropEncoder shared by every session.
+crop_encoder = None
+# ocr.ChatOCR for sending chat crops as text, if enabled.
+chat_ocr = None
+
+# Seconds per startup step, in the order they ran.
+startup_times = {}
 
-ws = None
-ws_thread = None
-connected = False
-PM_ACTIVE = False
-AUTO_CHAT_ACTIVE = False
-AUTO_CHAT_THREAD = None
-STOP_EVENT = threading.Event()
 
+@contextlib.contextmanager
+def startup_step(name):
+    start = time.perf_counter()
+    yield
+    startup_times[name] = time.perf_counter() - start
 
-matcher = TemplateMatcher(
-    window_title=config.matcher_config["window_title"],
-    global_chat_templates=config.matcher_config["global_chat_templates"],
-    private_chat_templates=config.matcher_config["private_chat_templates"],
-    private_chat_content_templates=config.matcher_config["private_chat_content_templates"],
-    global_chat_active_templates=config.matcher_config["global_chat_active_templates"],
-    offsets=config.matcher_config["offsets"],
-    threshold=config.matcher_config["threshold"],
-    overlap_threshold=config.matcher_config["overlap_threshold"]
-)
 
-controller = Controller(matcher.window, matcher)
-matcher.controller = controller
+def startup_report():
+    total = sum(startup_times.values())
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_times.items())
+    return f"Startup took {total * 1000:.0f} ms: {steps}"
 
 
-def on_message(ws, message):
-    global PM_ACTIVE, AUTO_CHAT_ACTIVE, AUTO_CHAT_THREAD, STOP_EVENT
+def configure_autoit():
+    if os.path.exists(autoit_dll_path):
+        os.environ['AUTOIT_X64_DLL'] = autoit_dll_path
+    else:
+        log.error(f"Error: {autoit_dll_path} not found.")
+
+
+def build_matcher(capture_backend, window=None, bank=None, process_pool=None):
+    from template_matcher import TemplateMatcher
+    return TemplateMatcher(
+        window_title=config.matcher_config["window_title"],
+        global_chat_templates=config.matcher_config["global_chat_templates"],
+        private_chat_templates=config.matcher_config["private_chat_templates"],
+        private_chat_content_templates=config.matcher_config["private_chat_content_templates"],
+        global_chat_active_templates=config.matcher_config["global_chat_active_templates"],
+        offsets=config.matcher_config["offsets"],
+        threshold=config.matcher_config["threshold"],
+        overlap_threshold=config.matcher_config["overlap_threshold"],
+        tracking=config.matcher_config["tracking"],
+        tracking_margin=config.matcher_config["tracking_margin"],
+        tracking_refresh_interval=config.matcher_config["tracking_refresh_interval"],
+        multi_instance_groups=config.matcher_config["multi_instance_groups"],
+        pyramid_groups=config.matcher_config["pyramid_groups"],
+        pyramid_scale=config.matcher_config["pyramid_scale"],
+        pyramid_slack=config.matcher_config["pyramid_slack"],
+        peak_kernel=config.matcher_config["peak_kernel"],
+        max_peaks=config.matcher_config["max_peaks"],
+        match_workers=config.matcher_config["match_workers"],
+        capture_backend=capture_backend,
+        diff_gate=config.matcher_config["diff_gate"],
+        diff_scale=config.matcher_config["diff_scale"],
+        diff_threshold=config.matcher_config["diff_threshold"],
+        diff_refresh_interval=config.matcher_config["diff_refresh_interval"],
+        window=window,
+        bank=bank,
+        process_pool=process_pool
+    )
+
+
+def setup(replay_path=None, warm_up=False):
+    """Startup phase: build one session per game window.
+
+    Every window listed in config.USERNAMES gets its own matcher and
+    controller; they share one template bank. Windows are paired with
+    usernames left to right, see find_windows. With a replay path there is a
+    single session whose frames come from recorded PNGs and whose input is
+    only recorded. With warm_up, every template is matched once before the
+    first command so that command does not pay for OpenCV's first-call setup.
+    """
+    global process_pool, crop_encoder, chat_ocr
+    if not config.USERNAMES:
+        raise RuntimeError(f"No user configured: set 'user' or 'users' in {config.CONFIG_FILE}.")
+    capture_backend = config.matcher_config["capture_backend"]
+    if replay_path is not None:
+        capture_backend = "replay"
+    else:
+        replay_path = config.matcher_config["replay_path"]
+
+    with startup_step("import matcher"):
+        from template_matcher import TemplateBank, find_windows
+        from capture import create_backend
+        from crop_dedup import CropDeduplicator
+
+    with startup_step("matcher"):
+        bank = TemplateBank(config.templates)
+        if config.matcher_config["match_processes"] > 0:
+            from match_pool import MatchPool
+            process_pool = MatchPool(config.templates, config.matcher_config["match_processes"])
+        usernames = config.USERNAMES
+        windows = [None] * len(usernames)
+        if capture_backend == "replay":
+            usernames, windows = usernames[:1], windows[:1]
+        else:
+            found = find_windows(config.matcher_config["window_title"])
+            if len(found) < len(usernames):
+                raise RuntimeError(
+                    f"{len(usernames)} users configured but {len(found)} "
+                    f"'{config.matcher_config['window_title']}' windows found! "
+                    f"Minimized windows are not counted.")
+            windows = found[:len(usernames)]
+        matchers = [build_matcher(create_backend(capture_backend, replay_path), window, bank, process_pool)
+                    for window in windows]
+
+    if capture_backend == "replay":
+        from recording_controller import RecordingController
+        controllers = [RecordingController(matchers[0])]
+    else:
+        # Imported here so headless replay runs do not need the Windows input libraries.
+        with startup_step("import controller"):
+            configure_autoit()
+            from controller import Controller
+        with startup_step("controller"):
+            controllers = [Controller(matcher.window, matcher) for matcher in matchers]
+
+    for username, matcher, controller in zip(usernames, matchers, controllers):
+        matcher.controller = controller
+        crop_deduplicator = None
+        if config.crop_dedup["enabled"]:
+            crop_deduplicator = CropDeduplicator(
+                scale=config.crop_dedup["scale"], tolerance=config.crop_dedup["tolerance"])
+        sessions.append(Session(username, matcher, controller, crop_deduplicator))
+    from encoder import CropEncoder
+    crop_encoder = CropEncoder(**config.crop_encoding)
+    if config.ocr["enabled"]:
+        from ocr import ChatOCR, GlyphFont
+        try:
+            chat_ocr = ChatOCR(GlyphFont.load(config.ocr["glyphs"]),
+                               glyph_threshold=config.ocr["glyph_threshold"],
+                               ink_threshold=config.ocr["ink_threshold"],
+                               ink_ratio=config.ocr["ink_ratio"])
+        except (OSError, ValueError) as e:
+            log.warning(f"Chat OCR disabled, glyphs could not be loaded: {e}")
+    log.info(f"Driving {len(sessions)} window(s): {', '.join(s.username for s in sessions)}")
+
+    if warm_up:
+        with startup_step("warm-up"):
+            for session in sessions:
+                session.matcher.warm_up()
+    return sessions
+
+
+def on_message(client, message):
+    """Handle one server command. Runs on the client's worker thread."""
+    session = client.session
+    matcher, controller, scheduler = session.matcher, session.controller, session.scheduler
+    command_id, action = None, None
     try:
         data = json.loads(message)
+        command_id = data.get("id")
         action = data.get("action")
         username = data.get("username")
         if not action or not username:
-            print("Invalid message: Missing 'action' or 'username'")
+            log.warning("Invalid message: Missing 'action' or 'username'")
             return
 
-        screen = matcher.capture_window_image()
+        frame = matcher.capture_frame()
 
         if action == "request_chat_data":
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.")
                 return
-            chat_data = matcher.detect_template('global_chat')
-            private_chat_data = matcher.detect_template('private_chat')
+            detections = matcher.detect_many(
+                frame, ['global_chat', 'private_chat'])
+            chat_data = detections['global_chat']
+            private_chat_data = detections['private_chat']
 
             if chat_data or private_chat_data:
                 send_requested_chat_data(
-                    ws, chat_data, private_chat_data, username)
+                    client, chat_data, private_chat_data, username)
             else:
-                print(f"No chat data found for user: {username}")
+                log.warning(f"No chat data found for user: {username}")
 
         elif action == "reset_view":
-            controller.reset_view(screen)
+            controller.reset_view(frame)
 
         elif action == "start_private_chat":
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.")
                 return
             start_coord = data.get("coords")
-            print("Starting private chat. Coordinates:", start_coord)
+            log.info(f"Starting private chat. Coordinates: {start_coord}")
             controller.click_on_point(start_coord, 6, [90, 0])
-            time.sleep(0.5)
+            controller.wait_for(
+                'private chat open',
+                lambda: controller.template_count('private_chat_content') > 0)
             open_private_chats = matcher.detect_template(
                 'private_chat_content')
 
@@ -119,349 +260,395 @@ def on_message(ws, message):
                 open_private_chat = open_private_chats[0]
                 controller.click_on_point(
                     open_private_chat['coordinates'], 3, [0, -170])
-                PM_ACTIVE = True
+                client.pm_active = True
 
             elif len(open_private_chats) == 0:
-                print("No private chat found.")
-                PM_ACTIVE = False
+                log.warning("No private chat found.")
+                client.pm_active = False
 
         elif action == "stop_private_chat":
 
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.")
                 return
-            controller.reset_view(screen)
-            PM_ACTIVE = False
+            controller.reset_view(frame)
+            client.pm_active = False
 
         elif action == "send_global_chat":
             msg = data.get("msg")
-            print("Sending global chat data. Message:", msg)
+            log.info(f"Sending global chat data. Message: {msg}")
 
-            x = matcher.detect_template('global_chat')
+            x = matcher.detect_template('global_chat', frame=frame)
             if x:
-                controller.send_global_chat(msg)
+                controller.send_global_chat(msg, frame)
 
         elif action == "send_private_chat":
             msg = data.get("msg")
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.")
                 return
-            pcc = matcher.detect_template('private_chat_content')
-            if PM_ACTIVE and len(pcc) == 1 and msg:
+            pcc = matcher.detect_template('private_chat_content', frame=frame)
+            if client.pm_active and len(pcc) == 1 and msg:
                 controller.send_private_chat_2(msg, pcc[0]['coordinates'])
 
         elif action == "start_auto_chat":
+            campaign_id = data.get("campaign_id") or "default"
             messages = data.get("messages")
             duration = data.get("duration")
             interval = data.get("interval")
 
-            print("Starting auto chat with data:",
-                  messages, interval, duration)
+            log.info(f"Starting auto chat '{campaign_id}' with data: {messages} {interval} {duration}")
 
             if not duration or duration <= 0:
-                print("Invalid duration for auto chat.")
+                log.warning("Invalid duration for auto chat.")
+                return
+            if not interval or interval <= 0 or not messages:
+                log.warning("Auto chat needs messages and a positive interval.")
                 return
-            if not AUTO_CHAT_ACTIVE:
-                AUTO_CHAT_ACTIVE = True
-                print(
-                    f"Starting auto chat for {duration} seconds at {interval}s intervals.")
-                STOP_EVENT.clear()
-                AUTO_CHAT_THREAD = threading.Thread(
-                    target=run_auto_chat,
-                    args=(ws, messages, interval, duration)
-                )
-                AUTO_CHAT_THREAD.start()
+            interval = scheduler.start(campaign_id, messages, interval, duration)
+            log.info(
+                f"Starting auto chat '{campaign_id}' for {duration} seconds at {interval}s intervals.")
+
+        elif action == "force_resend":
+            if session.crop_deduplicator is not None:
+                session.crop_deduplicator.reset()
+            log.info("Next chat crops will be sent in full.")
 
         elif action == "stop_auto_chat":
+            stopped = scheduler.stop(data.get("campaign_id"))
+            if stopped:
+                log.info(f"Auto chat stopped: {', '.join(stopped)}.")
 
-            if AUTO_CHAT_ACTIVE:
-                print("Stopping auto chat...")
-                AUTO_CHAT_ACTIVE = False
-                STOP_EVENT.set()
-                AUTO_CHAT_THREAD.join()
-                print("Auto chat stopped.")
+        elif action == "auto_chat_status":
+            send_auto_chat_status(client)
 
         else:
-            print(f"Unknown action: {action}")
+            log.warning(f"Unknown action: {action}")
     except json.JSONDecodeError:
-        print("Invalid message format. Expected JSON.")
-
-
-def on_error(ws, error):
-    print("WebSocket error:", error)
-
-
-def run_auto_chat(ws, messages, interval, duration):
-    global AUTO_CHAT_ACTIVE
-    start_time = time.time()
-    msg_index = 0
+        log.warning("Invalid message format. Expected JSON.")
+    finally:
+        # Commands that carry an id are acknowledged once handled, so the
+        # server can measure end-to-end latency.
+        if command_id is not None:
+            send_ack(client, command_id, action)
 
-    while AUTO_CHAT_ACTIVE and not STOP_EVENT.is_set():
-        current_time = time.time()
-        if current_time - start_time >= duration:
-            print("Auto chat duration complete.")
-            break
 
-        if msg_index < len(messages):
-            message = messages[msg_index]
-            print(f"Sending message: {message}")
-            send_auto_global_chat(ws, message)
-            msg_index = (msg_index + 1) % len(messages)
-
-        time.sleep(interval)
-
-    AUTO_CHAT_ACTIVE = False
+def on_coalesced(client, message):
+    """Acknowledge a command that was merged into an identical queued one, which has just run."""
+    data = json.loads(message)
+    if data.get("id") is not None:
+        send_ack(client, data["id"], data.get("action"))
 
 
 def send_auto_global_chat(ws, message):
+    matcher, controller = ws.session.matcher, ws.session.controller
     try:
-        x = matcher.detect_template('global_chat')
+        frame = matcher.capture_frame()
+        x = matcher.detect_template('global_chat', frame=frame)
         if x:
-            controller.send_global_chat(message)
+            controller.send_global_chat(message, frame)
     except Exception as e:
-        print(f"Error sending auto chat message: {e}")
-
+        log.error(f"Error sending auto chat message: {e}")
 
-def on_close(ws, close_status_code, close_msg):
-    global connected
-    print(f"WebSocket closed: {close_status_code}, {close_msg}")
-    connected = False
 
-
-def on_open(ws):
-    global connected
-    print("WebSocket connection established.")
-    connected = True
+def send_ack(ws, command_id, action):
+    try:
+        payload = {
+            'type': 'ack',
+            'id': command_id,
+            'action': action,
+            'username': ws.session.username,
+            'timestamp': int(time.time())
+        }
+        send_json(ws, payload)
+    except Exception as e:
+        log.error(f"Error sending ack: {e}")
 
 
-def send_heartbeat(ws, PM_ACTIVE, AUTO_CHAT_ACTIVE):
+def send_auto_chat_status(ws):
     try:
         payload = {
-            'type': 'heartbeat',
-            'username': config.USERNAME,
+            'type': 'auto_chat_status',
+            'username': ws.session.username,
             'timestamp': int(time.time()),
-            'auto_chat_active': AUTO_CHAT_ACTIVE,
-            'pm_active': PM_ACTIVE
+            'campaigns': ws.session.scheduler.status()
         }
-        ws.send(json.dumps(payload))
+        send_json(ws, payload)
     except Exception as e:
-        print(f"Error sending heartbeat: {e}")
+        log.error(f"Error sending auto chat status: {e}")
 
 
-def send_requested_chat_data(ws, global_chat_crops, private_chat_crops, username):
-    try:
-        global_chat_data = []
-        private_chat_data = []
-
-        for crop_data in global_chat_crops:
-            crop = crop_data['image']
-            coords = crop_data['coordinates']
+def on_open(client):
+    if client.session.crop_deduplicator is not None:
+        client.session.crop_deduplicator.reset()
 
-            _, img_encoded = cv2.imencode('.jpg', crop)
-            img_bytes = img_encoded.tobytes()
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
 
-            global_chat_data.append({
-                'image': img_base64,
-                'coordinates': coords
+def send_heartbeat(ws, pm_active, auto_chat_active):
+    try:
+        payload = {
+            'type': 'heartbeat',
+            'username': ws.session.username,
+            'timestamp': int(time.time()),
+            'auto_chat_active': auto_chat_active,
+            'pm_active': pm_active
+        }
+        send_json(ws, payload)
+    except Exception as e:
+        log.error(f"Error sending heartbeat: {e}")
+
+
+def send_binary_crops(ws, message_type, username, sections):
+    """Send crops as one binary frame. sections is a list of (section, crops, text_group); see encode_crops."""
+    crops = []
+    for section, section_crops, text_group in sections:
+        encoded = encode_crops(section_crops, text_group)
+        crops.extend((section, crop_data['coordinates'], image_format, image)
+                     for crop_data, (image_format, image) in zip(section_crops, encoded))
+    with metrics.timer('pack'):
+        data = pack_message(message_type, username, int(time.time()), crops)
+    start = time.perf_counter()
+    with metrics.timer('ws_send'):
+        ws.send(data)
+    crop_encoder.record_send(len(data), time.perf_counter() - start)
+
+
+def encode_crops(crops, text_group=None):
+    """Encode the changed crops in parallel; returns (format, bytes) per crop, (None, None) for unchanged ones.
+
+    With text_group, the template group of the crops, and OCR enabled, a crop
+    whose every line reads with enough confidence goes out as its text,
+    format 'text' in UTF-8, instead of an image.
+    """
+    encoded = [(None, None)] * len(crops)
+    images = []
+    for index, crop_data in enumerate(crops):
+        if crop_data.get('unchanged'):
+            continue
+        if text_group and chat_ocr is not None:
+            text = chat_ocr.read_text(crop_data['image'], config.ocr["min_confidence"],
+                                      config.ocr["areas"].get(text_group))
+            if text is not None:
+                encoded[index] = ('text', text.encode('utf-8'))
+                continue
+        images.append(index)
+    results = crop_encoder.encode_many([crops[index]['image'] for index in images])
+    for index, result in zip(images, results):
+        encoded[index] = result
+    return encoded
+
+
+def encode_base64(data):
+    with metrics.timer('base64'):
+        return base64.b64encode(data).decode('utf-8')
+
+
+def json_image(image_format, data):
+    """An encoded crop for the JSON messages: base64 for images, the string itself for text."""
+    if image_format == 'text':
+        return data.decode('utf-8')
+    return encode_base64(data)
+
+
+def json_crops(crops, text_group=None):
+    """Crops as JSON entries: image (base64, or the text), format and coordinates, or coordinates and 'unchanged'."""
+    data = []
+    for crop_data, (image_format, image) in zip(crops, encode_crops(crops, text_group)):
+        if image is None:
+            data.append({
+                'coordinates': crop_data['coordinates'],
+                'unchanged': True
             })
+            continue
+        data.append({
+            'image': json_image(image_format, image),
+            'format': image_format,
+            'coordinates': crop_data['coordinates']
+        })
+    return data
 
-        for crop_data in private_chat_crops:
-            crop = crop_data['image']
-            coords = crop_data['coordinates']
 
-            _, img_encoded = cv2.imencode('.jpg', crop)
-            img_bytes = img_encoded.tobytes()
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+def send_json(ws, payload):
+    with metrics.timer('json'):
+        text = json.dumps(payload)
+    start = time.perf_counter()
+    with metrics.timer('ws_send'):
+        ws.send(text)
+    crop_encoder.record_send(len(text), time.perf_counter() - start)
 
-            private_chat_data.append({
-                'image': img_base64,
-                'coordinates': coords
-            })
+
+def send_requested_chat_data(ws, global_chat_crops, private_chat_crops, username):
+    try:
+        if BINARY_PROTOCOL:
+            send_binary_crops(ws, 'chat_data', username, [
+                ('global', global_chat_crops, 'global_chat'), ('private', private_chat_crops, None)])
+            return
 
         payload = {
             'type': 'chat_data',
             'username': username,
             'timestamp': int(time.time()),
             'data': {
-                'global': global_chat_data,
-                'private': private_chat_data
+                'global': json_crops(global_chat_crops, 'global_chat'),
+                'private': json_crops(private_chat_crops)
             }
         }
-        ws.send(json.dumps(payload))
+        send_json(ws, payload)
     except Exception as e:
-        print(f"Error sending chat data: {e}")
+        log.error(f"Error sending chat data: {e}")
 
 
 def send_global_chat_crops(ws, crops):
     try:
-        images_as_base64 = []
-        coordinates = []
-
-        for crop_data in crops:
-            crop = crop_data['image']
-            coords = crop_data['coordinates']
-
-            _, img_encoded = cv2.imencode('.jpg', crop)
-            img_bytes = img_encoded.tobytes()
+        if BINARY_PROTOCOL:
+            send_binary_crops(ws, 'global', ws.session.username, [('global', crops, 'global_chat')])
+            return
 
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-            images_as_base64.append(img_base64)
-            coordinates.append(coords)
+        encoded = encode_crops(crops, 'global_chat')
 
         payload = {
             'type': 'global',
-            'username': config.USERNAME,
+            'username': ws.session.username,
             'data': [{
-                    "image": images_as_base64,
-                     "coordinates": coordinates
+                    "image": [json_image(image_format, image) for image_format, image in encoded],
+                    "format": [image_format for image_format, _ in encoded],
+                    "coordinates": [crop_data['coordinates'] for crop_data in crops]
                      }],
             'timestamp': int(time.time())
         }
-        ws.send(json.dumps(payload))
+        send_json(ws, payload)
     except Exception as e:
-        print(f"Error sending heartbeat: {e}")
+        log.error(f"Error sending heartbeat: {e}")
 
 
 def send_private_chat_crops(ws, crops):
     try:
-        data = []
-
-        for crop_data in crops:
-            image = crop_data['image']
-            coord = crop_data['coordinates']
-
-            _, img_encoded = cv2.imencode('.jpg', image)
-            img_bytes = img_encoded.tobytes()
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-
-            data.append({
-                'image': img_base64,
-                'coordinates': coord
-            })
+        if BINARY_PROTOCOL:
+            send_binary_crops(ws, 'private', ws.session.username, [('private', crops, False)])
+            return
 
         payload = {
             'type': 'private',
-            'username': config.USERNAME,
-            'data': data,
+            'username': ws.session.username,
+            'data': json_crops(crops),
             'timestamp': int(time.time())
         }
-        ws.send(json.dumps(payload))
+        send_json(ws, payload)
     except Exception as e:
-        print(f"Error sending private chat crops: {e}")
-
-
-def fetch_images_periodically():
-    global ws_thread
-    global ws
-    global PM_ACTIVE
-    global AUTO_CHAT_ACTIVE
-    if not connected:
-        print("WebSocket not connected; reconnecting...")
-        reconnect_websocket()
-
-    print("Heartbeat pm_active: ", PM_ACTIVE,
-          " auto_chat_active: ", AUTO_CHAT_ACTIVE)
-    if connected:
+        log.error(f"Error sending private chat crops: {e}")
+
+
+def reload_config():
+    """Pick up edits to config.txt. Runs on the worker thread, between commands."""
+    changed = config.reload()
+    if not changed:
+        return
+    log.info(f"Config reloaded, changed: {', '.join(changed)}")
+    for session in sessions:
+        session.matcher.apply_settings(config.matcher_config)
+        session.scheduler.min_interval = config.auto_chat["min_interval"]
+        session.scheduler.min_gap = config.auto_chat["min_gap"]
+        session.scheduler.max_per_minute = config.auto_chat["max_per_minute"]
+    crop_encoder.mode = config.crop_encoding["mode"]
+    crop_encoder.budget = config.crop_encoding["budget"]
+
+
+def fetch_images_periodically(client):
+    """Periodic tick: send the heartbeat and, in a private chat, its content. Runs on the worker thread."""
+    session = client.session
+    matcher, controller, scheduler = session.matcher, session.controller, session.scheduler
+    reload_config()
+    log.debug(f"{session.username}: heartbeat pm_active: {client.pm_active} auto_chat_active: {scheduler.active()}")
+    if scheduler.active():
+        log.debug("Auto chat:\n" + scheduler.summary())
+    if matcher.tracking:
+        log.debug(f"Tracking: {matcher.tracking_summary()}")
+    log.debug(f"Capture: {matcher.capture_backend.summary()}")
+    if matcher.diff_gate:
+        log.debug(f"Diff gate: {matcher.gate_summary()}")
+    log.debug(f"Encoding: {crop_encoder.summary()}")
+    if chat_ocr is not None:
+        log.debug(f"OCR: {chat_ocr.summary()}")
+    log.debug("Commands:\n" + client.executor.summary())
+    if client.connected:
         try:
-            screen = matcher.capture_window_image()
+            frame = matcher.capture_frame()
 
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.", extra=logger.THROTTLED)
                 return
 
         except Exception as e:
-            print(f"Error capturing the screen: {e}")
+            log.error(f"Error capturing the screen: {e}", extra=logger.THROTTLED)
             return
 
-        chat_data = matcher.detect_template('global_chat')
-        controller.center_x = controller.window.left + controller.window.width // 2
-        controller.center_y = controller.window.top + controller.window.height // 2 + 80
+        groups = ['global_chat']
+        if client.pm_active:
+            groups.append('private_chat_content')
+        detections = matcher.detect_many(frame, groups)
+        chat_data = detections['global_chat']
+        if controller.window is not None:
+            controller.center_x = controller.window.left + controller.window.width // 2
+            controller.center_y = controller.window.top + controller.window.height // 2 + 80
         if chat_data:
-            print("Sending heartbeat...")
-            send_heartbeat(ws, PM_ACTIVE, AUTO_CHAT_ACTIVE)
-        if PM_ACTIVE:
-            private_chat_content = matcher.detect_template(
-                'private_chat_content')
+            log.debug("Sending heartbeat...")
+            send_heartbeat(client, client.pm_active, scheduler.active())
+        if client.pm_active:
+            private_chat_content = detections['private_chat_content']
             if private_chat_content:
-                print("Sending private chat content...")
-                send_private_chat_content_crops(ws, private_chat_content)
+                log.debug("Sending private chat content...")
+                send_private_chat_content_crops(client, private_chat_content)
         else:
             pass
 
 
 def send_private_chat_content_crops(ws, crops):
+    """Send the open private chat windows, with markers for the ones that did not change.
+
+    Only the comparison runs here; encoding and sending are deferred to the
+    encoder's sender thread, so the worker can go on to the next capture.
+    While the last tick's crops are still on their way this tick is skipped,
+    so a slow link drops stale crops instead of queueing them up.
+    """
+    if crop_encoder.busy(ws.session.username):
+        log.debug(f"{ws.session.username}: private chat crops still sending, skipping this tick.")
+        return
+    crop_deduplicator = ws.session.crop_deduplicator
     try:
-        data = []
-
-        for crop_data in crops:
-            image = crop_data['image']
-            coord = crop_data['coordinates']
+        if crop_deduplicator is not None:
+            crops = crop_deduplicator.filter('private_chat_content', crops)
+    except Exception as e:
+        log.error(f"Error comparing private chat crops: {e}")
+        crop_deduplicator.reset()
+    # Capture backends may reuse their buffers (see MSSCapture), so the
+    # images must not change under the sender thread.
+    crops = [crop_data if crop_data.get('unchanged') else dict(crop_data, image=crop_data['image'].copy())
+             for crop_data in crops]
+    crop_encoder.defer(ws.session.username, write_private_chat_content_crops, ws, crops)
 
-            _, img_encoded = cv2.imencode('.jpg', image)
-            img_bytes = img_encoded.tobytes()
-            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
 
-            data.append({
-                'image': img_base64,
-                'coordinates': coord
-            })
+def write_private_chat_content_crops(ws, crops):
+    crop_deduplicator = ws.session.crop_deduplicator
+    try:
+        if BINARY_PROTOCOL:
+            send_binary_crops(ws, 'private_chat_content', ws.session.username, [('private', crops, 'private_chat_content')])
+            return
 
         payload = {
             'type': 'private_chat_content',
-            'username': config.USERNAME,
-            'data': data,
+            'username': ws.session.username,
+            'data': json_crops(crops, 'private_chat_content'),
             'timestamp': int(time.time())
         }
-        ws.send(json.dumps(payload))
+        send_json(ws, payload)
     except Exception as e:
-        print(f"Error sending private chat crops: {e}")
-
-
-def reconnect_websocket():
-    global ws_thread
-    global ws
-    global connected
-
-    if ws is None or not ws_thread.is_alive():
-        try:
-            print("Attempting to reconnect to WebSocket...")
-
-            if ws is not None:
-                ws.close()
-
-            ws = websocket.WebSocketApp(
-                SERVER_URL,
-                on_open=on_open,
-                on_message=on_message,
-                on_error=on_error,
-                on_close=on_close
-            )
-
-            if ws_thread is None or not ws_thread.is_alive():
-                ws_thread = threading.Thread(
-                    target=ws.run_forever, kwargs={"ping_interval": 10})
-                ws_thread.start()
-                print("WebSocket reconnecting...")
-
-            connected = False
-
-        except Exception as e:
-            print(f"Error reconnecting: {e}")
-            time.sleep(3)
-
-
-def check_and_send_heartbeat():
-    global SERVER_URL
-    if connected:
-        fetch_images_periodically()
-    else:
-        print("WebSocket is not connected. Trying to reconnect to url ", SERVER_URL)
-        reconnect_websocket()
+        log.error(f"Error sending private chat crops: {e}")
+        if crop_deduplicator is not None:
+            crop_deduplicator.reset()
 
 
 def download_update(url, save_path):
     print(f"Checking for updates from {url}...")
+    import requests
     with requests.get(url, stream=True) as response:
         if response.status_code == 200:
             with open(save_path, "wb") as file:
@@ -510,12 +697,72 @@ def check_for_update():
         trigger_update(zip_path, EXE_NAME)
 
 
+startup_times["import"] = time.perf_counter() - import_clock.STARTED
+
+
 if __name__ == "__main__":
+    # Lets the frozen executable start match_pool's worker processes.
+    import multiprocessing
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Knight OnLine chat bot.")
+    parser.add_argument("--replay", help="run headless on recorded PNG frames from this file or "
+                        "directory; input is recorded instead of sent")
+    parser.add_argument("--server", default=SERVER_URL, help="WebSocket server URL")
+    args = parser.parse_args()
+    logger.setup(config.log_settings)
     try:
         # check_for_update()
-        reconnect_websocket()
-        while True:
-            check_and_send_heartbeat()
-            time.sleep(3)
+        setup(args.replay, warm_up=config.WARM_UP)
+        with startup_step("import client"):
+            import asyncio
+            from bot_client import BotClient
+            from command_queue import CommandExecutor
+            from scheduler import AutoChatScheduler
+        # One worker thread runs the commands of every window, taking turns
+        # between them, so input to one window never interleaves with another's.
+        executor = CommandExecutor()
+        for session in sessions:
+            session.client = BotClient(
+                args.server,
+                on_command=on_message,
+                on_tick=fetch_images_periodically,
+                on_open=on_open,
+                on_coalesced=on_coalesced,
+                tick_interval=3,
+                ping_interval=10,
+                executor=executor,
+                lane=session.username
+            )
+            session.client.session = session
+            session.scheduler = AutoChatScheduler(
+                session.client, send_auto_global_chat, **config.auto_chat)
+        metrics.configure(config.metrics)
+        metrics.register_gauge('tracking', lambda: {
+            f"{session.username}:{key}": value
+            for session in sessions for key, value in session.matcher.tracking_stats.items()})
+        metrics.register_gauge('diff_gate', lambda: {
+            f"{session.username}:{key}": value
+            for session in sessions for key, value in session.matcher.gate_stats.items()})
+        metrics.register_gauge('capture', lambda: {
+            f"{session.username}:{key}": value
+            for session in sessions for key, value in session.matcher.capture_backend.stats.items()})
+        metrics.register_gauge('encoder', crop_encoder.gauge)
+        if chat_ocr is not None:
+            metrics.register_gauge('ocr', lambda: dict(chat_ocr.stats))
+        metrics.register_gauge('auto_chat_sent', lambda: {
+            f"{session.username}:{campaign['campaign_id']}": campaign['sent']
+            for session in sessions for campaign in session.scheduler.status()})
+        log.info(startup_report())
+
+        async def run_all():
+            try:
+                await asyncio.gather(*(session.client.run() for session in sessions))
+            finally:
+                executor.shutdown()
+                crop_encoder.shutdown()
+                if process_pool is not None:
+                    process_pool.shutdown()
+
+        asyncio.run(run_all())
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        log.error(f"An unexpected error occurred: {e}")
@@ -0,0 +1,83 @@
+"""Queue-backed logging for the bot.
+
+Code logs through `log` (the "ko" logger). The calling thread only formats
+the record and puts it on a queue; a QueueListener thread writes it to the
+console and to the rotating `log` file. Messages logged with
+extra=THROTTLED, such as a capture failing every tick, are dropped when
+repeated within repeat_window seconds, and the next one that gets through
+says how many were dropped. Every other record is always logged.
+
+Until setup() runs, records go nowhere except warnings and errors, which
+Python prints to stderr; so importing a module that logs has no side effects.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+log = logging.getLogger("ko")
+listener = None
+# Pass as extra= for a message that can repeat every tick.
+THROTTLED = {'throttled': True}
+
+
+class RepeatFilter(logging.Filter):
+    """Drops a throttled record identical (level and message) to one let through less than window seconds ago."""
+
+    def __init__(self, window=30, max_keys=1000):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.window <= 0 or not getattr(record, 'throttled', False):
+            return True
+        key = (record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            seen = self.seen.get(key)
+            if seen is not None and now - seen[0] < self.window:
+                seen[1] += 1
+                return False
+            if len(self.seen) >= self.max_keys:
+                self.seen.clear()
+            self.seen[key] = [now, 0]
+        if seen is not None and seen[1]:
+            record.msg = f"{record.getMessage()} (repeated {seen[1]} more times)"
+            record.args = ()
+        return True
+
+
+def setup(settings):
+    """Start the background writer for a config.log_settings dict. Safe to call once per process."""
+    global listener
+    if listener is not None:
+        return
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        settings.get("file", "log"), maxBytes=settings.get("max_bytes", 5_000_000),
+        backupCount=settings.get("backup_count", 3), encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] %(levelname)s %(message)s", "%Y-%m-%d %H:%M:%S"))
+    file_handler.setLevel(settings.get("level", "DEBUG"))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    console_handler.setLevel(settings.get("console_level", "INFO"))
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RepeatFilter(settings.get("repeat_window", 30)))
+
+    log.setLevel(min(file_handler.level, console_handler.level))
+    log.addHandler(queue_handler)
+    log.propagate = False
+
+    listener = logging.handlers.QueueListener(
+        records, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
@@ -0,0 +1,142 @@
+"""Runs TemplateMatcher's per-template matching in worker processes, with frames passed in shared memory."""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import metrics
+from template_matcher import EMPTY_BOXES, TemplateBank, TemplateMatcher
+
+# Shared frames a worker keeps attached; past this it lets go of all of them.
+MAX_ATTACHED = 16
+
+worker = None
+
+
+class SharedFrame:
+    """Shared memory block a matcher's grayscale frames are copied into, reused while they fit."""
+
+    def __init__(self):
+        self.memory = None
+        self.frame = None
+        self.shape = None
+        self.seq = 0
+
+    def write(self, frame):
+        """Copy frame in unless it is already there; returns (name, shape, seq) for the tasks."""
+        if frame is not self.frame:
+            gray = frame.gray
+            with metrics.timer('shm_write'):
+                if self.memory is None or self.memory.size < gray.nbytes:
+                    self.close()
+                    self.memory = shared_memory.SharedMemory(create=True, size=gray.nbytes)
+                np.ndarray(gray.shape, np.uint8, self.memory.buf)[:] = gray
+            self.frame = frame
+            self.shape = gray.shape
+            self.seq += 1
+        return self.memory.name, self.shape, self.seq
+
+    def close(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+            self.frame = None
+
+
+class WorkerMatcher:
+    """The matching half of TemplateMatcher, as it runs inside a worker process.
+
+    Settings arrive with every task, so edits picked up by apply_settings in
+    the main process take effect on the next detection.
+    """
+
+    prepare_search = TemplateMatcher.prepare_search
+    match_entry = TemplateMatcher.match_entry
+    match_pyramid = TemplateMatcher.match_pyramid
+    find_peaks = TemplateMatcher.find_peaks
+
+    def __init__(self, templates):
+        self.bank = TemplateBank(templates)
+        self.attached = {}
+        self.kernels = {}
+        # The templates of one group share a search area; the last one is kept.
+        self.search_key = None
+        self.search = None
+
+    def attach(self, name, shape):
+        memory = self.attached.get(name)
+        if memory is None:
+            if len(self.attached) >= MAX_ATTACHED:
+                self.search_key = self.search = None
+                for attached in self.attached.values():
+                    attached.close()
+                self.attached.clear()
+            memory = self.attached[name] = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, np.uint8, memory.buf)
+
+    def match(self, frame_name, shape, seq, template_path, roi, pyramid, settings):
+        self.threshold, self.pyramid_scale, self.pyramid_slack, kernel, self.max_peaks = settings
+        self.peak_kernel = self.kernels.get(kernel)
+        if self.peak_kernel is None:
+            self.peak_kernel = self.kernels[kernel] = np.ones((kernel, kernel), np.uint8)
+
+        key = (frame_name, seq, roi, pyramid, self.pyramid_scale)
+        if key != self.search_key:
+            self.search = self.prepare_search(self.attach(frame_name, shape), roi, pyramid)
+            self.search_key = key
+        return self.match_entry(self.search, self.bank.get(template_path))
+
+
+def init_worker(templates):
+    global worker
+    worker = WorkerMatcher(templates)
+
+
+def match_shared(frame_name, shape, seq, template_path, roi, pyramid, settings):
+    return worker.match(frame_name, shape, seq, template_path, roi, pyramid, settings)
+
+
+class MatchPool:
+    """Worker processes matching templates for any number of TemplateMatchers.
+
+    The numpy work around matchTemplate holds the GIL, so threads alone leave
+    most cores idle. Workers load the templates once and return the (N, 5)
+    boxes match_entry produces. Pass one to TemplateMatcher(process_pool=...) and its run_searches goes
+    through the pool. Workers are started on first use; call shutdown() to
+    stop them and free the shared frames.
+    """
+
+    def __init__(self, templates, workers):
+        self.workers = workers
+        # Spawned rather than forked: the bot has threads running by the time
+        # the pool starts, and Windows can only spawn anyway.
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker, initargs=(templates,))
+        self.shared_frames = []
+
+    def run_searches(self, matcher, frame, searches):
+        """Process pool version of TemplateMatcher.run_searches: {name: roi} in, {name: boxes} out."""
+        if matcher.shared_frame is None:
+            matcher.shared_frame = SharedFrame()
+            self.shared_frames.append(matcher.shared_frame)
+        frame_name, shape, seq = matcher.shared_frame.write(frame)
+        settings = matcher.match_settings()
+
+        tasks = []
+        for template_name, roi in searches.items():
+            pyramid = template_name in matcher.pyramid_groups
+            for entry in matcher.bank.groups.get(template_name, []):
+                future = self.executor.submit(
+                    match_shared, frame_name, shape, seq, entry['path'], roi, pyramid, settings)
+                tasks.append((template_name, future))
+
+        boxes = {template_name: [EMPTY_BOXES] for template_name in searches}
+        for template_name, future in tasks:
+            boxes[template_name].append(future.result())
+        return {template_name: np.concatenate(parts) for template_name, parts in boxes.items()}
+
+    def shutdown(self):
+        self.executor.shutdown()
+        for shared_frame in self.shared_frames:
+            shared_frame.close()
@@ -0,0 +1,224 @@
+"""Per-stage latency histograms.
+
+Code wraps a stage in `with metrics.timer('stage'):` or reports a duration it
+already measured with `metrics.observe('stage', seconds)`. Nothing is recorded
+until configure() enables collection; while disabled, timer() hands back a
+shared no-op context manager, so an instrumented stage costs one function call.
+
+Histograms can be served on a local HTTP endpoint in Prometheus text format
+(/metrics, or /metrics.json for the same data as JSON) and dumped to a JSON
+file at a fixed interval.
+"""
+import json
+import threading
+import time
+from logger import log
+
+# Upper bounds in seconds, from sub-millisecond matches to multi-second input.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+enabled = False
+histograms = {}
+gauges = {}
+lock = threading.Lock()
+server = None
+
+
+class Histogram:
+    """Bucketed durations of one stage; buckets are not cumulative until rendered."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Timer:
+    """Context manager that records the time spent in its block under one stage."""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+def timer(stage):
+    """Time a with-block as stage; a no-op while metrics are disabled."""
+    if not enabled:
+        return NULL_TIMER
+    return Timer(stage)
+
+
+def observe(stage, seconds):
+    """Record one duration for stage."""
+    if not enabled:
+        return
+    with lock:
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+def register_gauge(name, func):
+    """Export func() as a gauge; func returns a number or a {label: number} dict."""
+    gauges[name] = func
+
+
+def snapshot():
+    with lock:
+        stages = {stage: histogram.snapshot() for stage, histogram in histograms.items()}
+    return {'timestamp': time.time(), 'stages': stages, 'gauges': read_gauges()}
+
+
+def read_gauges():
+    values = {}
+    for name, func in list(gauges.items()):
+        try:
+            values[name] = func()
+        except Exception as e:
+            log.error(f"Error reading gauge {name}: {e}")
+    return values
+
+
+def render_prometheus():
+    lines = [
+        "# HELP ko_stage_seconds Time spent per pipeline stage.",
+        "# TYPE ko_stage_seconds histogram",
+    ]
+    with lock:
+        items = [(stage, list(h.counts), h.count, h.total) for stage, h in sorted(histograms.items())]
+    for stage, counts, count, total in items:
+        label = stage.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            lines.append(f'ko_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'ko_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {count}')
+        lines.append(f'ko_stage_seconds_sum{{stage="{label}"}} {total}')
+        lines.append(f'ko_stage_seconds_count{{stage="{label}"}} {count}')
+
+    for name, value in sorted(read_gauges().items()):
+        lines.append(f"# TYPE ko_{name} gauge")
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                lines.append(f'ko_{name}{{key="{key}"}} {item}')
+        else:
+            lines.append(f"ko_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics and /metrics.json from a daemon thread."""
+    global server
+    # Imported here: http.server is slow to import and only needed when serving.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(snapshot()).encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep scrapes out of the console
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    log.info(f"Metrics available at http://{host}:{port}/metrics")
+
+
+def dump_periodically(path, interval):
+    """Overwrite path with a JSON snapshot every interval seconds, from a daemon thread."""
+    def dump():
+        while True:
+            time.sleep(interval)
+            try:
+                with open(path, 'w') as f:
+                    json.dump(snapshot(), f, indent=2)
+            except OSError as e:
+                log.error(f"Error writing metrics to {path}: {e}")
+
+    threading.Thread(target=dump, name='metrics-dump', daemon=True).start()
+
+
+def configure(settings):
+    """Apply a config.metrics dict: enable collection, the HTTP endpoint and the JSON dump."""
+    global enabled
+    enabled = bool(settings.get('enabled'))
+    if not enabled:
+        return
+    if settings.get('port'):
+        try:
+            serve(settings['port'], settings.get('host', '127.0.0.1'))
+        except OSError as e:
+            log.error(f"Error starting metrics endpoint: {e}")
+    if settings.get('dump_path'):
+        dump_periodically(settings['dump_path'], settings.get('dump_interval', 60))
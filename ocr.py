@@ -0,0 +1,355 @@
+"""Reads chat text from crops drawn in the game's bitmap font, glyph by glyph with template matching."""
+import os
+import re
+import cv2
+import numpy as np
+import metrics
+from template_matcher import TemplateBank
+
+GLYPH_FILE = re.compile(r'u([0-9a-fA-F]{4,6})\.png')
+# A known glyph must score this much to mark where a touching one ends in learn().
+LOCATE_THRESHOLD = 0.9
+
+
+def binarize(image, ink_threshold=None, ink_ratio=None):
+    """Return a 0/1 uint8 mask of the text pixels of a crop.
+
+    Ink is brighter than the background in at least one channel, so the
+    channel maximum is thresholded, by Otsu unless ink_threshold is set. The
+    game smooths glyph edges, so with ink_ratio each line is thresholded
+    again at that fraction of its brightest pixel, which gives the same
+    strokes in every text colour.
+    """
+    gray = image.max(axis=2) if image.ndim == 3 else image
+    if ink_threshold is not None:
+        return (gray >= ink_threshold).astype(np.uint8)
+
+    _, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Dark text on a light background: Otsu picked the background.
+    if mask.mean() > 0.5:
+        mask = 1 - mask
+        gray = 255 - gray
+    if ink_ratio:
+        for top, bottom in runs(mask.any(axis=1)):
+            band = gray[top:bottom]
+            mask[top:bottom] = band >= ink_ratio * band.max()
+    return mask
+
+
+def runs(flags):
+    """(start, end) of every run of True in a 1-D array, end exclusive."""
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def find_lines(mask, height):
+    """(top, bottom) of every line of a mask: runs of rows with ink, merged while they fit in height together."""
+    lines = []
+    for start, end in runs(mask.any(axis=1)):
+        if lines and end - lines[-1][0] <= height:
+            lines[-1] = (lines[-1][0], end)
+        else:
+            lines.append((start, end))
+    return lines
+
+
+def dice(glyph, window):
+    """Overlap of a glyph's ink with the same-sized window of a mask, 0 to 1."""
+    total = glyph.sum() + window.sum()
+    return float(2 * (glyph * window).sum() / total) if total else 0.0
+
+
+class GlyphFont:
+    """Glyph cells of one bitmap font: {char: {'cell', 'ink', 'left', 'right', 'width'}}, ink in columns left:right.
+
+    On disk a font is a directory with one image per character, named after
+    the code point (u0041.png for "A"): the full line height and advance
+    width, ink white on black. u0020.png only sets the width of a space.
+    """
+
+    def __init__(self, glyphs=None, height=None):
+        self.glyphs = {}
+        self.height = height
+        for char, cell in (glyphs or {}).items():
+            self.add(char, cell)
+
+    def add(self, char, cell):
+        cell = (cell > 127).astype(np.float32) if cell.max() > 1 else cell.astype(np.float32)
+        if self.height is None:
+            self.height = cell.shape[0]
+        elif cell.shape[0] != self.height:
+            raise ValueError(f"Glyph {char!r} is {cell.shape[0]} px high, the font {self.height} px.")
+        columns = np.flatnonzero(cell.any(axis=0))
+        self.glyphs[char] = {
+            'cell': cell,
+            'ink': float(cell.sum()),
+            'left': int(columns[0]) if len(columns) else 0,
+            'right': int(columns[-1]) + 1 if len(columns) else 0,
+            'width': cell.shape[1],
+        }
+
+    @property
+    def space_width(self):
+        space = self.glyphs.get(' ')
+        if space is not None:
+            return space['width']
+        return max(2, int(np.median([glyph['width'] for glyph in self.glyphs.values()])) // 2)
+
+    @property
+    def glyph_gap(self):
+        """Blank columns between two glyphs, as most cells leave after their ink."""
+        gaps = [glyph['width'] - glyph['right'] + glyph['left']
+                for char, glyph in self.glyphs.items() if char != ' ' and glyph['ink']]
+        return int(np.median(gaps)) if gaps else 1
+
+    @classmethod
+    def load(cls, directory):
+        """Load every uXXXX.png glyph cell in directory."""
+        paths = {}
+        for name in os.listdir(directory):
+            match = GLYPH_FILE.fullmatch(name)
+            if match:
+                paths[chr(int(match.group(1), 16))] = os.path.join(directory, name)
+        if not paths:
+            raise FileNotFoundError(f"No glyph images found in {directory}")
+        bank = TemplateBank({char: [path] for char, path in paths.items()})
+        return cls({char: bank.groups[char][0]['gray'] for char in paths})
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for char, glyph in self.glyphs.items():
+            cv2.imwrite(os.path.join(directory, f"u{ord(char):04x}.png"),
+                        (glyph['cell'] * 255).astype(np.uint8))
+
+    def learn(self, mask, text, word_gap=4):
+        """Add the glyphs of one line of known text; returns the characters added.
+
+        mask is the binarized line cut to exactly the font height. Runs of ink
+        columns at least word_gap blank columns apart are words, paired with
+        the words of text. Without a space glyph, the typical word gap sets
+        the space width. Glyphs that touch are separated by learn_word; a
+        character that cannot be separated yet is left out, and learning
+        the line again once more glyphs are known may add it.
+        """
+        if self.height is not None and mask.shape[0] != self.height:
+            raise ValueError(f"The line is {mask.shape[0]} px high, the font {self.height} px.")
+        words, gaps = [], []
+        for start, end in runs(mask.any(axis=0)):
+            if words and start - words[-1][-1][1] < word_gap:
+                words[-1].append((start, end))
+                continue
+            if words:
+                gaps.append(start - words[-1][-1][1])
+            words.append([(start, end)])
+        labels = text.split()
+        if len(words) != len(labels):
+            raise ValueError(f"Found {len(words)} words for {len(labels)}.")
+
+        added = []
+        for label, segments in zip(labels, words):
+            added.extend(self.learn_word(mask, label, segments))
+        if ' ' not in self.glyphs and gaps:
+            # The glyph before a gap already leaves its own blank columns.
+            width = int(np.median(gaps)) - self.glyph_gap
+            self.add(' ', np.zeros((mask.shape[0], max(width, 1)), np.float32))
+        return added
+
+    def learn_word(self, mask, label, segments):
+        """Add the unknown characters of one word, given its runs of ink columns.
+
+        A run holds one character unless glyphs touch. Known characters are
+        stepped over by their ink width. An unknown one ends with its run if
+        the runs left are as many as the characters left, and otherwise
+        where the next character's glyph is found: further along the run,
+        or at the start of the next one. A word that cannot be split that
+        way is left there.
+        """
+        added = []
+        x = segments[0][0]
+        for index, char in enumerate(label):
+            run_end = next((end for start, end in segments if start <= x < end), None)
+            if run_end is None:
+                break
+            glyph = self.glyphs.get(char)
+            if glyph is not None:
+                stop = min(x + glyph['right'] - glyph['left'], run_end)
+            else:
+                runs_left = sum(1 for _, end in segments if end > x)
+                if runs_left == len(label) - index:
+                    stop = run_end
+                else:
+                    stop = self.locate(mask, label[index + 1:index + 2], x, run_end, segments)
+                if stop is None:
+                    break
+                cell = np.zeros((mask.shape[0], stop - x + self.glyph_gap), np.float32)
+                cell[:, :stop - x] = mask[:, x:stop]
+                self.add(char, cell)
+                added.append(char)
+            following = np.flatnonzero(mask[:, stop:segments[-1][1]].any(axis=0))
+            if not len(following):
+                break
+            x = stop + int(following[0])
+        return added
+
+    def locate(self, mask, char, start, run_end, segments):
+        """Find where the known glyph of char starts after start: inside the run, or at the next run.
+
+        Returns where the character before it ends, or None if char is
+        unknown or not found.
+        """
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            return None
+        ink = glyph['cell'][:, glyph['left']:glyph['right']]
+        width = ink.shape[1]
+        positions = list(range(start + 1, run_end))
+        following = [segment_start for segment_start, _ in segments if segment_start >= run_end]
+        if following:
+            positions.append(following[0])
+        best, best_score = None, LOCATE_THRESHOLD
+        for position in positions:
+            window = mask[:, position:position + width]
+            if window.shape[1] == width:
+                score = dice(ink, window)
+                if score >= best_score:
+                    best, best_score = position, score
+        return min(best, run_end) if best is not None else None
+
+
+class ChatOCR:
+    """Reads the lines of a chat crop with a GlyphFont.
+
+    Each line is decoded left to right: at the next ink column the glyph
+    whose ink overlaps best (Dice) wins, and decoding continues after its
+    ink, so touching glyphs are read too. A line's confidence is its worst
+    glyph score.
+    """
+
+    def __init__(self, font, glyph_threshold=0.8, ink_threshold=None, ink_ratio=None):
+        self.font = font
+        self.glyph_threshold = glyph_threshold
+        self.ink_threshold = ink_threshold
+        self.ink_ratio = ink_ratio
+        self.glyph_gap = font.glyph_gap
+        self.stats = {'text': 0, 'fallback': 0}
+
+        # Every glyph's ink columns, zero-padded to the widest one and
+        # flattened into a row of one matrix: one product scores all glyphs
+        # against a position.
+        self.chars = [char for char, glyph in font.glyphs.items() if glyph['ink'] > 0]
+        glyphs = [font.glyphs[char] for char in self.chars]
+        self.widths = np.array([glyph['right'] - glyph['left'] for glyph in glyphs])
+        self.max_width = int(self.widths.max())
+        cells = np.zeros((len(glyphs), font.height, self.max_width), np.float32)
+        for index, glyph in enumerate(glyphs):
+            cells[index, :, :self.widths[index]] = glyph['cell'][:, glyph['left']:glyph['right']]
+        self.glyph_matrix = cells.reshape(len(glyphs), -1)
+        self.inks = np.array([glyph['ink'] for glyph in glyphs], np.float32)
+        # Between equal scores the glyph explaining more ink wins, e.g. "m" over "n".
+        self.tie_break = self.inks * 1e-7
+
+    def read(self, image, area=None):
+        """Return the crop's lines as [{'text', 'confidence', 'top', 'bottom'}], top to bottom.
+
+        area (x, y, w, h) limits reading to the part of the crop with the chat
+        text, leaving out the rest of the window.
+        """
+        if area is not None:
+            x, y, w, h = area
+            image = image[y:y + h, x:x + w]
+        with metrics.timer('ocr'):
+            mask = binarize(image, self.ink_threshold, self.ink_ratio)
+            return [self.read_line(mask, top, bottom) for top, bottom in find_lines(mask, self.font.height)]
+
+    def read_text(self, image, min_confidence, area=None):
+        """The crop's text, lines joined by newlines, or None if any line is below min_confidence."""
+        lines = self.read(image, area)
+        if not lines or min(line['confidence'] for line in lines) < min_confidence:
+            self.stats['fallback'] += 1
+            return None
+        self.stats['text'] += 1
+        return "\n".join(line['text'] for line in lines)
+
+    def read_line(self, mask, top, bottom):
+        height = self.font.height
+        space = self.font.space_width
+        # Only this line's rows, with room above and below for the cell to
+        # slide over and room on the right for the widest glyph.
+        line = mask[top:bottom].astype(np.float32)
+        slack = max(height - (bottom - top), 0)
+        strip = cv2.copyMakeBorder(line, slack, slack, 0, self.max_width,
+                                   cv2.BORDER_CONSTANT, value=0)
+
+        ink_columns = strip.any(axis=0)
+        text, confidence = [], 1.0
+        x = self.next_ink(ink_columns, 0)
+        cursor = x
+        while x is not None:
+            gap = x - cursor - self.glyph_gap
+            if text and gap >= space / 2:
+                text.append(' ' * max(1, round(gap / space)))
+
+            best, score = self.best_glyph(strip[:, x:x + self.max_width])
+            if score < self.glyph_threshold:
+                text.append('?')
+                cursor = x + 1
+                while cursor < len(ink_columns) and ink_columns[cursor]:
+                    cursor += 1
+            else:
+                text.append(self.chars[best])
+                cursor = x + int(self.widths[best])
+            confidence = min(confidence, max(score, 0.0))
+            x = self.next_ink(ink_columns, cursor)
+
+        return {'text': ''.join(text), 'confidence': round(confidence, 4),
+                'top': int(top), 'bottom': int(bottom)}
+
+    def best_glyph(self, window):
+        """Score every glyph starting at the window's first column, at every height it fits; returns (index, score).
+
+        This is cv2.matchTemplate's TM_CCORR evaluated at one position for all
+        glyphs at once, turned into the Dice overlap of the two inks.
+        """
+        height = self.font.height
+        placements = np.lib.stride_tricks.sliding_window_view(window, (height, self.max_width))[:, 0]
+        overlap = self.glyph_matrix @ placements.reshape(len(placements), -1).T
+        # Ink under each glyph's own width, for every placement.
+        under = placements.sum(axis=1).cumsum(axis=1)[:, self.widths - 1].T
+        scores = (2 * overlap / (self.inks[:, None] + under + 1e-6)).max(axis=1)
+        best = int(np.argmax(scores + self.tie_break))
+        return best, float(scores[best])
+
+    @staticmethod
+    def next_ink(ink_columns, start):
+        found = np.flatnonzero(ink_columns[start:])
+        return int(start + found[0]) if len(found) else None
+
+    def summary(self):
+        total = self.stats['text'] + self.stats['fallback']
+        rate = self.stats['text'] / total * 100 if total else 0.0
+        return f"crops read as text: {self.stats['text']}, sent as images: {self.stats['fallback']} ({rate:.1f}% text)"
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Read a chat crop, or learn glyphs from a line of known text.")
+    parser.add_argument('image', help="crop to read, or with --learn a crop of exactly one line")
+    parser.add_argument('--glyphs', default='glyphs', help="glyph directory")
+    parser.add_argument('--learn', metavar='TEXT', help="the text in the image; its glyphs are added to --glyphs")
+    parser.add_argument('--ink-threshold', type=int)
+    parser.add_argument('--ink-ratio', type=float)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        raise SystemExit(f"Cannot read {args.image}")
+    if args.learn:
+        font = GlyphFont.load(args.glyphs) if os.path.isdir(args.glyphs) else GlyphFont()
+        mask = binarize(image, args.ink_threshold, args.ink_ratio)
+        added = font.learn(mask, args.learn)
+        font.save(args.glyphs)
+        print(f"Added {len(added)} glyphs: {''.join(added)!r}")
+    else:
+        ocr = ChatOCR(GlyphFont.load(args.glyphs), ink_threshold=args.ink_threshold, ink_ratio=args.ink_ratio)
+        for line in ocr.read(image):
+            print(f"{line['confidence']:.3f}  {line['text']}")
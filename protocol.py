@@ -0,0 +1,97 @@
+"""Binary WebSocket frames for chat crops.
+
+The JSON messages carry each crop as a base64 string with its format. The
+binary format carries the same fields with the raw image bytes:
+
+    header   !BBIB   version, message type, timestamp, username length
+             ...     username (UTF-8)
+             !H      crop count
+    crop     !BBiiiiI  section, image format, x, y, w, h, image length
+             ...       image bytes
+
+All integers are big-endian. Message types and sections use the codes below;
+for 'chat_data' the section tells global crops from private ones, the other
+message types only use 'global' or 'private' to match their JSON type.
+A crop with the 'unchanged' format and no image bytes stands for a crop that
+looks the same as the last one sent from that slot. Images are JPEG or PNG,
+see encoder.py; a 'text' crop carries the text read from it (ocr.py) in
+UTF-8 instead, one line per row of chat.
+"""
+import struct
+
+VERSION = 1
+
+MESSAGE_TYPES = {
+    'chat_data': 1,
+    'global': 2,
+    'private': 3,
+    'private_chat_content': 4,
+}
+SECTIONS = {
+    'global': 0,
+    'private': 1,
+}
+IMAGE_FORMATS = {
+    'unchanged': 0,
+    'jpeg': 1,
+    'png': 2,
+    'text': 3,
+}
+
+HEADER = struct.Struct('!BBIB')
+COUNT = struct.Struct('!H')
+CROP = struct.Struct('!BBiiiiI')
+
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+SECTION_NAMES = {code: name for name, code in SECTIONS.items()}
+IMAGE_FORMAT_NAMES = {code: name for name, code in IMAGE_FORMATS.items()}
+
+
+def pack_message(message_type, username, timestamp, crops):
+    """Build a binary frame. crops is a list of (section, coordinates, image format, image bytes), with None for both if unchanged."""
+    name = username.encode('utf-8')
+    parts = [
+        HEADER.pack(VERSION, MESSAGE_TYPES[message_type], timestamp, len(name)),
+        name,
+        COUNT.pack(len(crops)),
+    ]
+    for section, coords, image_format, image in crops:
+        if image is None:
+            image_format, image = 'unchanged', b''
+        parts.append(CROP.pack(
+            SECTIONS[section], IMAGE_FORMATS[image_format],
+            int(coords['x']), int(coords['y']), int(coords['w']), int(coords['h']),
+            len(image)))
+        parts.append(image)
+    return b''.join(parts)
+
+
+def unpack_message(data):
+    """Parse a binary frame back into a dict, for servers and tests."""
+    version, message_type, timestamp, name_length = HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary message version: {version}")
+    offset = HEADER.size
+    username = bytes(data[offset:offset + name_length]).decode('utf-8')
+    offset += name_length
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+
+    crops = []
+    for _ in range(count):
+        section, image_format, x, y, w, h, length = CROP.unpack_from(data, offset)
+        offset += CROP.size
+        crops.append({
+            'section': SECTION_NAMES[section],
+            'format': IMAGE_FORMAT_NAMES[image_format],
+            'coordinates': {'x': x, 'y': y, 'w': w, 'h': h},
+            'image': bytes(data[offset:offset + length]),
+        })
+        offset += length
+
+    return {
+        'type': MESSAGE_TYPE_NAMES[message_type],
+        'username': username,
+        'timestamp': timestamp,
+        'crops': crops,
+    }
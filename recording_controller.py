@@ -0,0 +1,71 @@
+import time
+from collections import deque
+import config
+from step_stats import StepStats
+
+# Recorded actions kept; older ones are dropped so long replays stay bounded.
+MAX_ACTIONS = 10000
+
+
+class RecordingController(StepStats):
+    """Stand-in for Controller in headless replay mode: records the input it would send instead of sending it.
+
+    It exposes the methods knight_chat_bot.py calls on the real controller.
+    Every call is appended to actions as {'time', 'action', 'args'}, keeping
+    the last MAX_ACTIONS. Waits check their predicate once, because recorded
+    frames do not react to input.
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.window = None
+        self.center_x = 0
+        self.center_y = 0
+        self.actions = deque(maxlen=MAX_ACTIONS)
+        self.step_stats = {}
+
+    def record(self, action, *args):
+        self.actions.append({'time': time.time(), 'action': action, 'args': list(args)})
+        # As the real controller does after input, so replays pay the same matching.
+        self.matcher.reset_gate()
+        config.log_info(f"replay input: {action} {args}")
+
+    def wait_for(self, label, predicate, timeout=None):
+        start = time.perf_counter()
+        held = predicate()
+        self.record_step(label, time.perf_counter() - start, held)
+        return held
+
+    def template_count(self, template_name):
+        return len(self.matcher.detect_template(template_name))
+
+    def focus_window(self):
+        self.record('focus_window')
+        return True
+
+    def is_window_focused(self):
+        return True
+
+    def reset_view(self, frame=None):
+        if frame is not None:
+            self.matcher.detect_many(frame, ['private_chat_content', 'global_chat_active'])
+        self.record('reset_view')
+
+    def ensure_clean_view(self, frame=None):
+        self.reset_view(frame)
+
+    def send_global_chat(self, message, frame=None):
+        self.ensure_clean_view(frame)
+        self.record('send_global_chat', message)
+
+    def send_private_chat(self, coords, message):
+        self.record('send_private_chat', coords, message)
+
+    def send_private_chat_2(self, message, coords=None):
+        self.record('send_private_chat_2', message, coords)
+
+    def click_on_point(self, coords, times, offset=[0, 0]):
+        self.record('click_on_point', coords, times, offset)
+
+    def drag_and_drop_2(self, start_coords, end_coords):
+        self.record('drag_and_drop_2', start_coords, end_coords)
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from logger import log
+
+
+class Campaign:
+    """One named auto chat campaign: its messages, its period and how closely the sends kept to it."""
+
+    def __init__(self, campaign_id, messages, interval, duration, now):
+        self.id = campaign_id
+        self.messages = list(messages)
+        self.interval = interval
+        self.duration = duration
+        self.started = now
+        self.deadline = now + duration
+        self.next_due = now
+        self.index = 0
+        self.stopped = False
+
+        self.sent = 0
+        self.missed = 0
+        self.last_sent = None
+        self.gap_count = 0
+        self.gap_total = 0.0
+        self.gap_min = None
+        self.gap_max = None
+
+    def next_message(self):
+        message = self.messages[self.index]
+        self.index = (self.index + 1) % len(self.messages)
+        return message
+
+    def advance(self, now):
+        """Move next_due to the first slot of the fixed grid after now; slots already past are counted as missed."""
+        self.next_due += self.interval
+        while self.next_due <= now:
+            self.next_due += self.interval
+            self.missed += 1
+
+    def record_send(self, at):
+        if self.last_sent is not None:
+            gap = at - self.last_sent
+            self.gap_count += 1
+            self.gap_total += gap
+            self.gap_min = gap if self.gap_min is None else min(self.gap_min, gap)
+            self.gap_max = gap if self.gap_max is None else max(self.gap_max, gap)
+        self.last_sent = at
+        self.sent += 1
+
+    def status(self, now):
+        average = self.gap_total / self.gap_count if self.gap_count else None
+        return {
+            'campaign_id': self.id,
+            'messages': len(self.messages),
+            'sent': self.sent,
+            'missed': self.missed,
+            'target_interval': self.interval,
+            'actual_interval_avg': round(average, 3) if average is not None else None,
+            'actual_interval_min': round(self.gap_min, 3) if self.gap_min is not None else None,
+            'actual_interval_max': round(self.gap_max, 3) if self.gap_max is not None else None,
+            'next_in': round(max(0.0, self.next_due - now), 3),
+            'remaining': round(max(0.0, self.deadline - now), 3),
+        }
+
+
+class AutoChatScheduler:
+    """Runs named auto chat campaigns side by side on the client's event loop.
+
+    Each campaign sends on a fixed grid, start + k * interval, so the time a
+    send takes does not push the next one back. Sends run on the client's worker
+    thread under the 'auto_chat' command name. Campaign intervals are never
+    shorter than min_interval, and across all campaigns sends are at least
+    min_gap seconds apart and at most max_per_minute in any 60 seconds; a send
+    held back by these limits goes out late and the grid is left as it was.
+    """
+
+    def __init__(self, client, send, min_interval=2.0, min_gap=1.0, max_per_minute=20):
+        self.client = client
+        self.send = send
+        self.min_interval = min_interval
+        self.min_gap = min_gap
+        self.max_per_minute = max_per_minute
+
+        self.campaigns = {}
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.task = None
+        self.wakeup = None
+
+    def start(self, campaign_id, messages, interval, duration):
+        """Start a campaign, replacing a running one with the same id. Returns the interval actually used."""
+        interval = max(interval, self.min_interval)
+        with self.lock:
+            previous = self.campaigns.get(campaign_id)
+            if previous is not None:
+                previous.stopped = True
+                log.info(f"Auto chat campaign '{campaign_id}' replaced.")
+            self.campaigns[campaign_id] = Campaign(
+                campaign_id, messages, interval, duration, time.monotonic())
+        # Outside the lock: spawn waits on the event loop, where run() takes it.
+        if self.task is None:
+            self.task = self.client.spawn(self.run())
+        self.wake()
+        return interval
+
+    def stop(self, campaign_id=None):
+        """Stop one campaign, or all of them when campaign_id is None; returns the ids stopped."""
+        with self.lock:
+            if campaign_id is None:
+                stopped = list(self.campaigns.values())
+                self.campaigns.clear()
+            else:
+                campaign = self.campaigns.pop(campaign_id, None)
+                stopped = [campaign] if campaign is not None else []
+            for campaign in stopped:
+                campaign.stopped = True
+        self.wake()
+        return [campaign.id for campaign in stopped]
+
+    def active(self):
+        return bool(self.campaigns)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [campaign.status(now) for campaign in self.campaigns.values()]
+
+    def summary(self):
+        lines = []
+        for status in self.status():
+            actual = status['actual_interval_avg']
+            actual = f"{actual:.2f}s" if actual is not None else "-"
+            lines.append(
+                f"  {status['campaign_id']}: {status['sent']} sent, {status['missed']} missed,"
+                f" interval target {status['target_interval']:.2f}s actual {actual},"
+                f" {status['remaining']:.0f}s left")
+        return "\n".join(lines) or "  no campaigns"
+
+    def wake(self):
+        if self.wakeup is not None:
+            self.client.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def rate_limited_until(self, now):
+        """Earliest time the global limits allow another send."""
+        while self.recent and self.recent[0] <= now - 60:
+            self.recent.popleft()
+        until = now
+        if self.recent:
+            until = max(until, self.recent[-1] + self.min_gap)
+        if self.max_per_minute and len(self.recent) >= self.max_per_minute:
+            until = max(until, self.recent[-self.max_per_minute] + 60)
+        return until
+
+    def expire(self, now):
+        for campaign in list(self.campaigns.values()):
+            if now >= campaign.deadline:
+                del self.campaigns[campaign.id]
+                campaign.stopped = True
+                status = campaign.status(now)
+                log.info(f"Auto chat campaign '{campaign.id}' complete: {status['sent']} sent,"
+                         f" interval target {status['target_interval']}s"
+                         f" actual {status['actual_interval_avg']}s.")
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                now = time.monotonic()
+                self.expire(now)
+                campaign = min(self.campaigns.values(), key=lambda c: c.next_due, default=None)
+                if campaign is not None:
+                    due = max(campaign.next_due, self.rate_limited_until(now))
+                    if due <= now:
+                        message = campaign.next_message()
+                        campaign.advance(now)
+
+            if campaign is None:
+                await self.wakeup.wait()
+                continue
+            if due > now:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.client.run_blocking(
+                    self.send_now, campaign, message, name='auto_chat')
+            except Exception as e:
+                log.error(f"Error sending auto chat message: {e}")
+
+    def send_now(self, campaign, message):
+        """Worker-thread side of a send; a campaign stopped while this was queued sends nothing."""
+        if campaign.stopped:
+            return
+        now = time.monotonic()
+        with self.lock:
+            campaign.record_send(now)
+            self.recent.append(now)
+        log.debug(f"Sending message ({campaign.id}): {message}")
+        self.send(self.client, message)
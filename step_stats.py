@@ -0,0 +1,31 @@
+import config
+import metrics
+
+
+class StepStats:
+    """Latency counters per input step, shared by Controller and RecordingController.
+
+    Subclasses set self.step_stats = {} in __init__: label -> {'count',
+    'seconds', 'max', 'timeouts'} for waits and whole flows.
+    """
+
+    def record_step(self, label, seconds, confirmed=True):
+        stats = self.step_stats.setdefault(
+            label, {'count': 0, 'seconds': 0.0, 'max': 0.0, 'timeouts': 0})
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        if not confirmed:
+            stats['timeouts'] += 1
+        metrics.observe(f"input:{label}", seconds)
+        config.log_info(
+            f"{label}: {seconds * 1000:.0f} ms{'' if confirmed else ' (timed out)'}")
+
+    def step_summary(self):
+        """Average and worst latency per step, with how often a wait timed out."""
+        lines = []
+        for label, stats in sorted(self.step_stats.items()):
+            lines.append(
+                f"{label}: {stats['count']}x, {stats['seconds'] / stats['count'] * 1000:.0f} ms avg, "
+                f"{stats['max'] * 1000:.0f} ms max, {stats['timeouts']} timeouts")
+        return "\n".join(lines)
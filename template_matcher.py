@@ -1,14 +1,102 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-import pygetwindow as gw
-from PIL import ImageGrab
 import config
-from controller import Controller
+import metrics
+from logger import THROTTLED, log
+from capture import PILCapture
+from frame import Frame, to_gray
+
+EMPTY_BOXES = np.empty((0, 5), np.float32)
+EMPTY_POINTS = np.empty((0, 3), np.float32)
+
+
+def extract_peaks(result, threshold, kernel, max_peaks, offset_x=0, offset_y=0, inner=None):
+    """Return an (N, 3) array of x, y, confidence for the local maxima over the threshold.
+
+    Only positions that are the maximum of their kernel neighbourhood are kept,
+    and at most max_peaks of them (the highest scoring), so NMS gets a handful
+    of candidates per match instead of every pixel over the threshold. With
+    inner (x0, y0, x1, y1), only peaks inside it are kept; the rest of the
+    result only serves as their neighbourhood.
+    """
+    peaks = (result >= threshold) & (result >= cv2.dilate(result, kernel))
+    if inner is not None:
+        x0, y0, x1, y1 = inner
+        peaks[:y0] = False
+        peaks[y1:] = False
+        peaks[:, :x0] = False
+        peaks[:, x1:] = False
+    ys, xs = np.nonzero(peaks)
+    scores = result[ys, xs]
+    if len(scores) > max_peaks:
+        keep = np.argpartition(scores, -max_peaks)[-max_peaks:]
+        xs, ys, scores = xs[keep], ys[keep], scores[keep]
+
+    points = np.empty((len(scores), 3), np.float32)
+    points[:, 0] = xs + offset_x
+    points[:, 1] = ys + offset_y
+    points[:, 2] = scores
+    return points
+
+
+def find_windows(title, include_minimized=False):
+    """All game windows with this title, ordered left to right, then top to bottom, so the order is stable.
+
+    Minimized windows are left out unless include_minimized: Windows parks
+    them at (-32000, -32000), which would sort them first.
+    """
+    # Imported here because pygetwindow refuses to import on Linux,
+    # where the matcher can still run on replayed frames.
+    import pygetwindow as gw
+    windows = gw.getWindowsWithTitle(title)
+    if not include_minimized:
+        windows = [window for window in windows if not window.isMinimized]
+    return sorted(windows, key=lambda window: (window.left, window.top))
+
+
+class TemplateBank:
+    """Templates loaded from disk once and kept as grayscale arrays; one bank can serve several matchers."""
+
+    def __init__(self, templates):
+        self.entries = {}
+        self.groups = {}
+        for name, paths in templates.items():
+            self.groups[name] = [self.get(path) for path in paths]
+
+    def get(self, template_path):
+        """Return the preprocessed entry for a template path, loading it on first use."""
+        entry = self.entries.get(template_path)
+        if entry is None:
+            template = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
+            if template is None:
+                raise FileNotFoundError(
+                    f"Template image not found: {template_path}")
+            gray = to_gray(template)
+            entry = {
+                'path': template_path,
+                'gray': gray,
+                'w': gray.shape[1],
+                'h': gray.shape[0],
+                'scaled': {},
+            }
+            self.entries[template_path] = entry
+        return entry
+
+    def scaled(self, entry, scale):
+        """Return a downscaled copy of a template, resized once per scale."""
+        scaled = entry['scaled'].get(scale)
+        if scaled is None:
+            scaled = cv2.resize(entry['gray'], None, fx=scale, fy=scale,
+                                interpolation=cv2.INTER_AREA)
+            entry['scaled'][scale] = scaled
+        return scaled
 
 
 class TemplateMatcher:
-    def __init__(self, window_title, global_chat_templates, private_chat_templates, private_chat_content_templates, global_chat_active_templates, offsets, threshold=0.5, overlap_threshold=0.5):
+    def __init__(self, window_title, global_chat_templates, private_chat_templates, private_chat_content_templates, global_chat_active_templates, offsets, threshold=0.5, overlap_threshold=0.5, tracking=False, tracking_margin=40, tracking_refresh_interval=20, multi_instance_groups=(), pyramid_groups=(), pyramid_scale=0.5, pyramid_slack=0.15, peak_kernel=3, max_peaks=64, match_workers=4, capture_backend=None, diff_gate=False, diff_scale=0.125, diff_threshold=16, diff_refresh_interval=20, window=None, bank=None, process_pool=None):
         self.controller = None
         self.window_title = window_title
         self.global_chat_templates = global_chat_templates
@@ -18,16 +106,76 @@ class TemplateMatcher:
         self.offsets = offsets
         self.threshold = threshold
         self.overlap_threshold = overlap_threshold
+        self.tracking = tracking
+        self.tracking_margin = tracking_margin
+        self.tracking_refresh_interval = tracking_refresh_interval
+        self.multi_instance_groups = set(multi_instance_groups)
+        # Last known area per template group: {'box': (x, y, w, h), 'searches': n}
+        self.tracked = {}
+        self.tracking_stats = {'roi_hits': 0, 'roi_misses': 0, 'full_searches': 0}
+        self.pyramid_groups = set(pyramid_groups)
+        self.pyramid_scale = pyramid_scale
+        self.pyramid_slack = pyramid_slack
+        self.peak_kernel = np.ones((peak_kernel, peak_kernel), np.uint8)
+        self.max_peaks = max_peaks
+        self.match_workers = match_workers
+        self.pool = None
+        # A match_pool.MatchPool, when matching runs in worker processes.
+        self.process_pool = process_pool
+        self.shared_frame = None
+        self.diff_gate = diff_gate
+        self.diff_scale = diff_scale
+        self.diff_threshold = diff_threshold
+        self.diff_refresh_interval = diff_refresh_interval
+        # Last matched result per group: {'thumbnail', 'boxes', 'area', 'reuses'}
+        self.gate_cache = {}
+        self.gate_stats = {'skipped': 0, 'executed': 0}
         self.window_position = None
         self.top_center = None
-        self.window = self.get_window()
-        if not self.window:
-            raise RuntimeError(f"Window '{self.window_title}' not found!")
-        print(f"Window '{self.window_title}' found.")
+        self.capture_backend = capture_backend or PILCapture()
+        self.bank = bank or TemplateBank(config.templates)
+        for name in self.pyramid_groups:
+            for entry in self.bank.groups.get(name, []):
+                self.bank.scaled(entry, self.pyramid_scale)
+        self.window = None
+        if self.capture_backend.requires_window:
+            self.window = window or self.get_window()
+            if not self.window:
+                raise RuntimeError(f"Window '{self.window_title}' not found!")
+            log.info(f"Window '{self.window_title}' found.")
+
+    def apply_settings(self, settings):
+        """Apply the tunable keys of a matcher_config dict to the running matcher.
+
+        Called between commands, so a detection never runs with a mix of old and
+        new values. Tracked areas and the diff gate's cache were found with the
+        old values and are dropped. match_workers, match_processes and the
+        capture backend need a restart.
+        """
+        self.threshold = settings['threshold']
+        self.overlap_threshold = settings['overlap_threshold']
+        self.tracking = settings['tracking']
+        self.tracking_margin = settings['tracking_margin']
+        self.tracking_refresh_interval = settings['tracking_refresh_interval']
+        self.multi_instance_groups = set(settings['multi_instance_groups'])
+        self.tracked = {}
+        self.pyramid_groups = set(settings['pyramid_groups'])
+        self.pyramid_scale = settings['pyramid_scale']
+        self.pyramid_slack = settings['pyramid_slack']
+        for name in self.pyramid_groups:
+            for entry in self.bank.groups.get(name, []):
+                self.bank.scaled(entry, self.pyramid_scale)
+        self.peak_kernel = np.ones((settings['peak_kernel'], settings['peak_kernel']), np.uint8)
+        self.max_peaks = settings['max_peaks']
+        self.diff_gate = settings['diff_gate']
+        self.diff_scale = settings['diff_scale']
+        self.diff_threshold = settings['diff_threshold']
+        self.diff_refresh_interval = settings['diff_refresh_interval']
+        self.reset_gate()
 
     def get_window(self):
         """Get the game window by title."""
-        windows = gw.getWindowsWithTitle(self.window_title)
+        windows = find_windows(self.window_title, include_minimized=True)
         if windows:
             windows[0].activate()
             return windows[0]
@@ -35,10 +183,17 @@ class TemplateMatcher:
 
     def capture_window_image(self):
         """Capture the game window."""
+        if not self.capture_backend.requires_window:
+            screen = self.capture_backend.grab(None)
+            if screen is not None:
+                self.window_position = {"top": 0, "left": 0}
+                self.top_center = {"top": 0, "left": screen.shape[1] // 2}
+            return screen
+
         left, top, right, bottom = self.window.left, self.window.top, self.window.right, self.window.bottom
 
         if right <= left or bottom <= top:
-            print("Window is minimized or invalid. Skipping capture.")
+            log.warning("Window is minimized or invalid. Skipping capture.", extra=THROTTLED)
             return None
         
         top += config.grab_screen_offset['top']
@@ -50,119 +205,444 @@ class TemplateMatcher:
         self.top_center = {"top": top , "left": left + (right - left) // 2}
         # print(f"Window position: {self.window_position}")
         try:
-            screenshot = ImageGrab.grab(
-                bbox=(left, top, right, bottom))
-            return cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
+            return self.capture_backend.grab((left, top, right, bottom))
         except ValueError as e:
-            print(f"Error capturing the screen: {e}")
+            log.error(f"Error capturing the screen: {e}", extra=THROTTLED)
             return None
 
-    def match_template_with_confidence(self, screen, templates):
-        """Match multiple templates within the screen and return bounding boxes with confidence."""
-        all_boxes = []
+    def capture_frame(self):
+        """Capture the game window once and wrap it in a Frame for the current tick."""
+        with metrics.timer('capture'):
+            screen = self.capture_window_image()
+        if screen is None:
+            return None
+        return Frame(screen, dict(self.window_position), dict(self.top_center))
+
+    def match_template_with_confidence(self, screen, templates, roi=None, pyramid=False):
+        """Match multiple templates within the screen and return bounding boxes with confidence.
+
+        When roi is given as (x, y, w, h) only that part of the screen is searched,
+        and the returned boxes are still in full-screen coordinates. With pyramid
+        set, candidates are found on a downscaled screen first and only refined
+        at full resolution around them.
+        """
+        search = self.prepare_search(screen, roi, pyramid)
+        all_boxes = [EMPTY_BOXES]
         for template_path in templates:
-            template = cv2.imread(template_path, cv2.IMREAD_UNCHANGED)
-            if template is None:
-                raise FileNotFoundError(
-                    f"Template image not found: {template_path}")
-
-            screen_gray = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
-            template_gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-
+            all_boxes.append(self.match_entry(search, self.bank.get(template_path)))
+        return np.concatenate(all_boxes)
+
+    def prepare_search(self, screen, roi=None, pyramid=False):
+        """Cut the search area out of the screen once, so every template of a group can share it."""
+        screen_gray = to_gray(screen)
+        roi_x, roi_y = 0, 0
+        if roi is not None:
+            roi_x, roi_y, roi_w, roi_h = roi
+            screen_gray = screen_gray[roi_y:roi_y + roi_h, roi_x:roi_x + roi_w]
+
+        small_gray = None
+        if pyramid:
+            small_gray = cv2.resize(screen_gray, None, fx=self.pyramid_scale, fy=self.pyramid_scale,
+                                    interpolation=cv2.INTER_AREA)
+        return {'gray': screen_gray, 'small': small_gray, 'x': roi_x, 'y': roi_y}
+
+    def match_entry(self, search, entry):
+        """Match one template inside a prepared search area and return its boxes."""
+        screen_gray = search['gray']
+        if entry['h'] > screen_gray.shape[0] or entry['w'] > screen_gray.shape[1]:
+            return EMPTY_BOXES
+
+        with metrics.timer('match'):
+            if search['small'] is not None:
+                points = self.match_pyramid(screen_gray, search['small'], entry)
+            else:
+                result = cv2.matchTemplate(
+                    screen_gray, entry['gray'], cv2.TM_CCOEFF_NORMED)
+                points = self.find_peaks(result)
+
+        boxes = np.empty((len(points), 5), np.float32)
+        boxes[:, 0] = points[:, 0] + search['x']
+        boxes[:, 1] = points[:, 1] + search['y']
+        boxes[:, 2] = entry['w']
+        boxes[:, 3] = entry['h']
+        boxes[:, 4] = points[:, 2]
+        return boxes
+
+    def match_pyramid(self, screen_gray, small_gray, entry):
+        """Find candidates on the downscaled screen, then rescore them at full resolution.
+
+        Every returned score comes from a full-resolution matchTemplate, so it
+        is the value the full search would produce. This is an approximation
+        of the full search all the same: a match whose downscaled score falls
+        below threshold - pyramid_slack is not refined and is lost.
+        """
+        scale = self.pyramid_scale
+        template_small = self.bank.scaled(entry, scale)
+        small_h, small_w = template_small.shape[:2]
+        if (small_h < 4 or small_w < 4 or small_h > small_gray.shape[0]
+                or small_w > small_gray.shape[1]):
             result = cv2.matchTemplate(
-                screen_gray, template_gray, cv2.TM_CCOEFF_NORMED)
-            locations = np.where(result >= self.threshold)
-            confidences = [result[pt[1], pt[0]]
-                           for pt in zip(*locations[::-1])]
-
-            boxes = [
-                (pt[0], pt[1], template.shape[1], template.shape[0], conf)
-                for pt, conf in zip(zip(*locations[::-1]), confidences)
-            ]
-            all_boxes.extend(boxes)
-
-        return all_boxes
-
-    def detect_template(self, template_name, verbose=False, focus=False):
-        templates = config.templates.get(template_name, None)
-        if not templates:
-            print(f"Error: No templates found for {template_name}.")
+                screen_gray, entry['gray'], cv2.TM_CCOEFF_NORMED)
+            return self.find_peaks(result)
+
+        coarse = cv2.matchTemplate(
+            small_gray, template_small, cv2.TM_CCOEFF_NORMED)
+        candidates = (coarse >= self.threshold - self.pyramid_slack).astype(np.uint8)
+        if not candidates.any():
+            return EMPTY_POINTS
+
+        # Refine each group of neighbouring candidates once, with enough padding
+        # to cover the rounding between the two scales. The refined result
+        # reaches radius further, so a peak at the edge of the area is only
+        # kept if it beats its whole neighbourhood, as in the full search.
+        pad = int(np.ceil(1 / scale)) + 1
+        radius = self.peak_kernel.shape[0] // 2
+        result_h = screen_gray.shape[0] - entry['h'] + 1
+        result_w = screen_gray.shape[1] - entry['w'] + 1
+        count, _, stats, _ = cv2.connectedComponentsWithStats(
+            cv2.dilate(candidates, np.ones((3, 3), np.uint8)))
+
+        points = [EMPTY_POINTS]
+        for x, y, w, h, _ in stats[1:count]:
+            x0 = max(int(x / scale) - pad, 0)
+            y0 = max(int(y / scale) - pad, 0)
+            x1 = min(int(np.ceil((x + w) / scale)) + pad, result_w)
+            y1 = min(int(np.ceil((y + h) / scale)) + pad, result_h)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            wx0, wy0 = max(x0 - radius, 0), max(y0 - radius, 0)
+            wx1, wy1 = min(x1 + radius, result_w), min(y1 + radius, result_h)
+            window = screen_gray[wy0:wy1 + entry['h'] - 1, wx0:wx1 + entry['w'] - 1]
+            result = cv2.matchTemplate(
+                window, entry['gray'], cv2.TM_CCOEFF_NORMED)
+            points.append(self.find_peaks(result, wx0, wy0,
+                                          (x0 - wx0, y0 - wy0, x1 - wx0, y1 - wy0)))
+        return np.concatenate(points)
+
+    def match_settings(self):
+        """The settings match_entry depends on, as sent to worker processes."""
+        return (self.threshold, self.pyramid_scale, self.pyramid_slack,
+                self.peak_kernel.shape[0], self.max_peaks)
+
+    def find_peaks(self, result, offset_x=0, offset_y=0, inner=None):
+        """Extract peaks from a match result with the matcher's settings."""
+        return extract_peaks(result, self.threshold, self.peak_kernel, self.max_peaks,
+                             offset_x, offset_y, inner)
+
+    def plan_search(self, frame, template_name):
+        """Return the area to search for a group: its tracked ROI, or None for the whole frame."""
+        if not self.tracking or template_name in self.multi_instance_groups:
+            return None
+        track = self.tracked.get(template_name)
+        if track and track['searches'] < self.tracking_refresh_interval:
+            track['searches'] += 1
+            return self.expand_roi(track['box'], frame)
+        return None
+
+    def record_search(self, template_name, roi, boxes, retry=False):
+        """Update tracking state and counters after a search of a group.
+
+        retry marks the full search after an ROI miss, which is already
+        counted as the miss.
+        """
+        if not self.tracking:
+            return
+        if roi is not None:
+            if len(boxes):
+                self.tracking_stats['roi_hits'] += 1
+                self.tracked[template_name]['box'] = self.bounding_box(boxes)
+            else:
+                self.tracking_stats['roi_misses'] += 1
+                self.tracked.pop(template_name, None)
+            return
+
+        if not retry:
+            self.tracking_stats['full_searches'] += 1
+        if len(boxes) and template_name not in self.multi_instance_groups:
+            self.tracked[template_name] = {
+                'box': self.bounding_box(boxes), 'searches': 0}
+        else:
+            self.tracked.pop(template_name, None)
+
+    def run_searches(self, frame, searches):
+        """Match every template of every group in searches ({name: roi}) and return {name: boxes}.
+
+        The cv2.matchTemplate calls run on the matcher's thread pool; OpenCV releases
+        the GIL while matching, so the templates are matched on several cores.
+        With a process pool, each template is matched in a worker process instead.
+        """
+        if self.process_pool is not None:
+            return self.process_pool.run_searches(self, frame, searches)
+
+        tasks = []
+        for template_name, roi in searches.items():
+            search = self.prepare_search(
+                frame.gray, roi, template_name in self.pyramid_groups)
+            for entry in self.bank.groups.get(template_name, []):
+                tasks.append((template_name, search, entry))
+
+        pool = self.get_pool()
+        if pool is None:
+            matches = [self.match_entry(search, entry) for _, search, entry in tasks]
+        else:
+            futures = [pool.submit(self.match_entry, search, entry) for _, search, entry in tasks]
+            matches = [future.result() for future in futures]
+
+        boxes = {template_name: [EMPTY_BOXES] for template_name in searches}
+        for (template_name, _, _), match in zip(tasks, matches):
+            boxes[template_name].append(match)
+        return {template_name: np.concatenate(parts) for template_name, parts in boxes.items()}
+
+    def warm_up(self, width=640, height=480):
+        """Match every template once on a blank frame, so OpenCV's first-call setup and the thread pool are paid for at startup.
+
+        The frame is at least width x height and large enough for the biggest
+        template, since templates that do not fit are skipped.
+        """
+        for entries in self.bank.groups.values():
+            for entry in entries:
+                width, height = max(width, entry['w']), max(height, entry['h'])
+        image = np.zeros((height, width, 3), np.uint8)
+        frame = Frame(image, {'left': 0, 'top': 0}, {'left': 0, 'top': 0})
+        self.run_searches(frame, {name: None for name in self.bank.groups})
+        self.non_max_suppression(np.array([[0, 0, 10, 10, 1.0]], np.float32))
+
+    def get_pool(self):
+        """Thread pool shared by all detections, created on first use."""
+        if self.match_workers <= 1:
+            return None
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.match_workers, thread_name_prefix="match")
+        return self.pool
+
+    def expand_roi(self, box, frame):
+        """Grow a box by the tracking margin, clipped to the frame."""
+        x, y, w, h = box
+        margin = self.tracking_margin
+        left = max(x - margin, 0)
+        top = max(y - margin, 0)
+        right = min(x + w + margin, frame.width)
+        bottom = min(y + h + margin, frame.height)
+        return left, top, right - left, bottom - top
+
+    @staticmethod
+    def bounding_box(boxes):
+        """Smallest (x, y, w, h) box covering all matched boxes."""
+        left = int(boxes[:, 0].min())
+        top = int(boxes[:, 1].min())
+        right = int((boxes[:, 0] + boxes[:, 2]).max())
+        bottom = int((boxes[:, 1] + boxes[:, 3]).max())
+        return left, top, right - left, bottom - top
+
+    def reuse_unchanged(self, frame, template_names):
+        """Serve groups whose area looks the same as when they were last matched from the cache.
+
+        Crops are still cut from the new frame, so only the matching is skipped.
+        After diff_refresh_interval reuses in a row a group is matched again,
+        so a change the thumbnail misses does not last. Returns the groups
+        that still have to be matched.
+        """
+        if not self.diff_gate:
+            return template_names
+
+        thumbnail = frame.thumbnail(self.diff_scale)
+        remaining = []
+        for name in template_names:
+            cached = self.gate_cache.get(name)
+            if (cached is None or cached['reuses'] >= self.diff_refresh_interval
+                    or self.area_changed(cached, thumbnail)):
+                self.gate_stats['executed'] += 1
+                remaining.append(name)
+                continue
+
+            self.gate_stats['skipped'] += 1
+            cached['reuses'] += 1
+            boxes = cached['boxes']
+            if len(boxes) == 0:
+                frame.detections[name] = []
+                continue
+            frame.detections[name] = self.get_cropped_images(
+                frame.image, boxes, config.offsets.get(name, {}))
+            frame.boxes[name] = boxes
+        return remaining
+
+    def area_changed(self, cached, thumbnail):
+        """Compare a thumbnail with the cached one, around the group's boxes or over the whole frame.
+
+        Any thumbnail pixel (an average of a block of screen pixels) moving by
+        more than diff_threshold gray levels counts as a change.
+        """
+        previous = cached['thumbnail']
+        if previous.shape != thumbnail.shape:
+            return True
+        if cached['area'] is not None:
+            x, y, w, h = cached['area']
+            scale = self.diff_scale
+            left = max(int(x * scale) - 1, 0)
+            top = max(int(y * scale) - 1, 0)
+            right = int((x + w) * scale) + 2
+            bottom = int((y + h) * scale) + 2
+            previous = previous[top:bottom, left:right]
+            thumbnail = thumbnail[top:bottom, left:right]
+        return int(cv2.absdiff(previous, thumbnail).max()) > self.diff_threshold
+
+    def remember_detection(self, frame, name):
+        """Cache a fresh detection for the diff gate.
+
+        Groups that can appear more than once are compared over the whole
+        frame, since a new instance can open outside the old ones.
+        """
+        if not self.diff_gate or name not in frame.detections:
+            return
+        boxes = frame.boxes.get(name, EMPTY_BOXES)
+        area = None
+        if len(boxes) and name not in self.multi_instance_groups:
+            area = self.bounding_box(boxes)
+        self.gate_cache[name] = {
+            'thumbnail': frame.thumbnail(self.diff_scale),
+            'boxes': boxes,
+            'area': area,
+            'reuses': 0,
+        }
+
+    def reset_gate(self):
+        """Forget cached detections, so the next detections run full matching; called after every input."""
+        self.gate_cache.clear()
+
+    def gate_summary(self):
+        """Describe how often the diff gate skipped matching."""
+        stats = self.gate_stats
+        total = stats['skipped'] + stats['executed']
+        skip_rate = stats['skipped'] / total * 100 if total else 0.0
+        return (f"matches skipped: {stats['skipped']}, executed: {stats['executed']} "
+                f"({skip_rate:.1f}% skipped)")
+
+    def tracking_summary(self):
+        """Describe how often tracked searches stayed inside the ROI; a miss's full search is part of the miss."""
+        stats = self.tracking_stats
+        searches = stats['roi_hits'] + stats['roi_misses'] + stats['full_searches']
+        hit_rate = stats['roi_hits'] / searches * 100 if searches else 0.0
+        return (f"ROI hits: {stats['roi_hits']}, ROI misses: {stats['roi_misses']}, "
+                f"full searches: {stats['full_searches']} ({hit_rate:.1f}% cheap path)")
+
+    def detect_template(self, template_name, verbose=False, focus=False, frame=None):
+        """Detect a template group on the given frame, capturing a new one if none is passed."""
+        if not config.templates.get(template_name, None):
+            log.warning(f"Error: No templates found for {template_name}.")
             return []
 
         if verbose:
-            print(f"Detecting templates for: {template_name}")
+            log.debug(f"Detecting templates for: {template_name}")
 
         try:
-            screen = None
-            try:
-                screen = self.capture_window_image()
-            except Exception as e:
-                print(f"Error capturing screen image: {e}")
-            
-            if screen is None:
-                print("Error: Failed to capture the screen.")
+            if frame is None:
+                try:
+                    frame = self.capture_frame()
+                except Exception as e:
+                    log.error(f"Error capturing screen image: {e}")
+
+            if frame is None:
+                log.warning("Error: Failed to capture the screen.", extra=THROTTLED)
                 return []
-            
+
+            if template_name in frame.detections:
+                return frame.detections[template_name]
+
             if focus:
                 try:
                     self.controller.focus_window()
                 except Exception as e:
-                    print(f"Error focusing window: {e}")
+                    log.error(f"Error focusing window: {e}")
                     return []
 
-            try:
-                boxes = self.match_template_with_confidence(screen, templates)
-            except Exception as e:
-                print(f"Error during template matching: {e}")
-                return []
-            
-            if not boxes:
-                return []
+            return self.detect_many(frame, [template_name])[template_name]
 
-            try:
-                boxes = self.non_max_suppression(boxes)
-            except Exception as e:
-                print(f"Error during non-max suppression: {e}")
-                return []
+        except Exception as e:
+            log.error(f"Unexpected error during template detection: {e}")
+            return []
 
+    def detect_many(self, frame, template_names):
+        """Detect several template groups on one frame in a single parallel pass.
+
+        Returns {template_name: cropped images}. Results are memoized on the frame,
+        so groups that were already detected on it are not matched again.
+        """
+        pending = []
+        for template_name in template_names:
+            if template_name in frame.detections or template_name in pending:
+                continue
+            if not config.templates.get(template_name, None):
+                log.warning(f"Error: No templates found for {template_name}.")
+                continue
+            pending.append(template_name)
+
+        pending = self.reuse_unchanged(frame, pending)
+        if pending:
+            start = time.perf_counter()
             try:
-                cropped_images = self.get_cropped_images(screen, boxes, config.offsets.get(template_name, {}))
+                # Tracked groups are searched in their ROI first; the ones that
+                # miss there get a second, full-frame pass.
+                searches = {name: self.plan_search(frame, name) for name in pending}
+                found = self.run_searches(frame, searches)
+                retry = {}
+                for name, roi in searches.items():
+                    self.record_search(name, roi, found[name])
+                    if roi is not None and len(found[name]) == 0:
+                        retry[name] = None
+                if retry:
+                    retried = self.run_searches(frame, retry)
+                    for name in retry:
+                        self.record_search(name, None, retried[name], retry=True)
+                    found.update(retried)
             except Exception as e:
-                print(f"Error cropping images: {e}")
-                return []
+                log.error(f"Error during template matching: {e}")
+                return {name: frame.detections.get(name, []) for name in template_names}
 
-            return cropped_images
+            for name in pending:
+                boxes = found[name]
+                if len(boxes) == 0:
+                    frame.detections[name] = []
+                    continue
 
-        except Exception as e:
-            print(f"Unexpected error during template detection: {e}")
-            return []
+                try:
+                    with metrics.timer('nms'):
+                        boxes = self.non_max_suppression(boxes)
+                except Exception as e:
+                    log.error(f"Error during non-max suppression: {e}")
+                    continue
+
+                try:
+                    with metrics.timer('crop'):
+                        frame.detections[name] = self.get_cropped_images(
+                            frame.image, boxes, config.offsets.get(name, {}))
+                    frame.boxes[name] = boxes
+                except Exception as e:
+                    log.error(f"Error cropping images: {e}")
+
+            for name in pending:
+                self.remember_detection(frame, name)
+            metrics.observe('detect', time.perf_counter() - start)
 
+        return {name: frame.detections.get(name, []) for name in template_names}
 
     def non_max_suppression(self, boxes):
         """Filter overlapping boxes using non-maximum suppression."""
-        if not boxes:
-            return []
-
-        boxes = np.array(boxes)
-        x1 = boxes[:, 0]
-        y1 = boxes[:, 1]
-        x2 = x1 + boxes[:, 2]
-        y2 = y1 + boxes[:, 3]
-        scores = boxes[:, 4]
+        if len(boxes) == 0:
+            return EMPTY_BOXES
 
+        boxes = np.asarray(boxes, np.float32)
         indices = cv2.dnn.NMSBoxes(
-            bboxes=[[int(x), int(y), int(w), int(h)]
-                    for x, y, w, h in boxes[:, :4]],
-            scores=scores.tolist(),
+            bboxes=boxes[:, :4].astype(np.int32),
+            scores=boxes[:, 4],
             score_threshold=self.threshold,
             nms_threshold=self.overlap_threshold,
         )
 
         if len(indices) == 0:
-            return []
+            return EMPTY_BOXES
 
-        indices = indices.flatten()
-        return [boxes[i] for i in indices]
+        return boxes[np.asarray(indices).flatten()]
 
     def draw_boxes_with_confidence_and_save_images(self, screen, boxes, label, offset, output_dir="output_images"):
         """Draw rectangles around detected areas with confidence scores and save the cropped images from these areas."""
@@ -208,18 +688,15 @@ class TemplateMatcher:
 
     def refresh_and_display(self):
         """Capture the screen, match templates, and display results."""
-        screen = self.capture_window_image()
-        chat_boxes = self.match_template_with_confidence(
-            screen, self.global_chat_templates)
-        private_chat_boxes = self.match_template_with_confidence(
-            screen, self.private_chat_templates)
-        private_chat_content_boxes = self.match_template_with_confidence(
-            screen, self.private_chat_content_templates)
-
-        chat_boxes = self.non_max_suppression(chat_boxes)
-        private_chat_boxes = self.non_max_suppression(private_chat_boxes)
-        private_chat_content_boxes = self.non_max_suppression(
-            private_chat_content_boxes)
+        frame = self.capture_frame()
+        screen = frame.image
+        self.detect_many(
+            frame, ['global_chat', 'private_chat', 'private_chat_content'])
+
+        chat_boxes = frame.boxes.get('global_chat', EMPTY_BOXES)
+        private_chat_boxes = frame.boxes.get('private_chat', EMPTY_BOXES)
+        private_chat_content_boxes = frame.boxes.get(
+            'private_chat_content', EMPTY_BOXES)
 
         screen_with_boxes = self.draw_boxes_with_confidence_and_save_images(
             screen, chat_boxes, "Chat Box", self.offsets["global_chat"])
@@ -234,6 +711,7 @@ class TemplateMatcher:
         """Extract and return cropped images based on the bounding boxes, along with coordinates."""
         cropped_images = []
         for x, y, w, h, conf in boxes:
+            x, y, w, h = int(x), int(y), int(w), int(h)
             y = max(y - offset[0], 0)
             h += offset[0]
             w += offset[1]
@@ -241,7 +719,7 @@ class TemplateMatcher:
             x = max(x - offset[3], 0)
             w += offset[3]
 
-            cropped_image = screen[int(y):int(y + h), int(x):int(x + w)]
+            cropped_image = screen[y:y + h, x:x + w]
 
             cropped_images.append({
                 'coordinates': {'x': x, 'y': y, 'w': w, 'h': h},